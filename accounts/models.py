@@ -4,6 +4,14 @@ from django.db import models
 from django.utils.timezone import now
 
 
+class ProcessingStatus(models.TextChoices):
+    """Where an uploaded image is in its background processing."""
+
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+
+
 class UserManager(BaseUserManager):
     def create_user(self, email, password, **extra_fields):
         if not email:
@@ -33,13 +41,19 @@ class User(AbstractUser):
     profile_image = models.ImageField(
         default="accounts/images/default_profile_image.png", upload_to="accounts/images"
     )
+    # Resized copies of profile_image, see apis.variants.
+    profile_image_variants = models.JSONField(
+        default=dict, blank=True, editable=False)
+    profile_image_status = models.CharField(
+        max_length=10, choices=ProcessingStatus.choices,
+        default=ProcessingStatus.READY, editable=False)
     bio = models.TextField(blank=True, null=True)
     has_garden = models.BooleanField(default=False)
     experience = models.IntegerField(
         default=1, null=False, validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     created_at = models.DateTimeField(default=now)
-    updated_at = models.DateTimeField(default=now)
+    updated_at = models.DateTimeField(auto_now=True)
     objects = UserManager()
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
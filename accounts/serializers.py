@@ -4,7 +4,9 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 
+from apis.fields import BoundedImageField
 from apis.serializers import CommentSerializer, GardenSerializer
+from apis.variants import variant_urls
 
 User = get_user_model()
 
@@ -14,6 +16,7 @@ class AuthUserSerializer(serializers.ModelSerializer):
     gardens = GardenSerializer(many=True, required=False)
     comments = CommentSerializer(
         many=True, required=False, source="receiver_comments")
+    profile_image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -23,10 +26,16 @@ class AuthUserSerializer(serializers.ModelSerializer):
             "bio",
             "gardens",
             "profile_image",
+            "profile_image_variants",
+            "profile_image_status",
             "experience",
             "comments",
         )
 
+    def get_profile_image_variants(self, user):
+        return variant_urls(self.context.get("request"), user.profile_image,
+                            user.profile_image_variants)
+
     def get_profile_image(self, user):
         request = self.context.get("request")
         if user.profile_image.url:
@@ -70,7 +79,7 @@ class UserRegisterSerializer(serializers.ModelSerializer):
     bio = serializers.CharField(
         style={"base_template": "textarea.html"}, required=False
     )
-    profile_image = serializers.ImageField(required=False)
+    profile_image = BoundedImageField(required=False)
     experience = serializers.IntegerField(
         required=True, validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
@@ -103,7 +112,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
     bio = serializers.CharField(
         style={"base_template": "textarea.html"}, required=False
     )
-    profile_image = serializers.ImageField(required=False)
+    profile_image = BoundedImageField(required=False)
 
     class Meta:
         model = User
@@ -0,0 +1,38 @@
+"""Helpers shared by the test modules of the project."""
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.test import override_settings
+
+
+def data_queries(context):
+    """Queries captured by a CaptureQueriesContext, leaving out those of
+    the database cache and its savepoints."""
+    table = getattr(cache, "_table", None)
+    return [
+        query for query in context.captured_queries
+        if "SAVEPOINT" not in query["sql"] and not (table and table in query["sql"])
+    ]
+
+
+class TemporaryMediaMixin:
+    """Save the files uploaded by a test case in a temporary MEDIA_ROOT,
+    removed once its tests have run. The media_files of the checkout are
+    copied there first."""
+
+    media_files = ()
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        for name in cls.media_files:
+            os.makedirs(os.path.join(media_root, os.path.dirname(name)), exist_ok=True)
+            shutil.copy(default_storage.path(name), os.path.join(media_root, name))
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        cls.addClassCleanup(media_override.disable)
+        super().setUpClass()
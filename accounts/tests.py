@@ -1,5 +1,7 @@
 import json
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
@@ -7,10 +9,11 @@ from apis.models import Comment
 
 from .factory import UserFactory
 from .models import User
+from .testing import TemporaryMediaMixin, data_queries
 from .utils import temporary_image
 
 
-class TestRegisterUser(APITestCase):
+class TestRegisterUser(TemporaryMediaMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user("john@snow.com", "johnpassword")
         self.client.login(email="john@snow.com", password="johnpassword")
@@ -179,6 +182,55 @@ class TestGetUserDetail(APITestCase):
         assert self.user.id in receiver_id_list
 
 
+class TestUserConditionalGet(APITestCase):
+    def setUp(self):
+        # Versions are bumped on commit, which the test case never reaches.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user("john@snow.com", "johnpassword")
+            self.user2 = User.objects.create_user("hello@lol.fr", "hellofoobar")
+
+    def test_should_return_304_until_the_profile_or_its_comments_change(self):
+        etag = self.client.get(f"/api/users/{self.user.id}")["ETag"]
+        response = self.client.get(
+            f"/api/users/{self.user.id}", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        Comment.objects.create(
+            author_id=self.user2.id, receiver_id=self.user.id, content="FooBar")
+        response = self.client.get(
+            f"/api/users/{self.user.id}", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        etag = response["ETag"]
+
+        self.user2.nickname = "Jon"
+        self.user2.save()
+        response = self.client.get(
+            f"/api/users/{self.user.id}", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_should_return_304_for_an_unchanged_user_list(self):
+        etag = self.client.get("/api/users")["ETag"]
+        response = self.client.get("/api/users", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.bio = "winter is coming"
+            self.user.save()
+        response = self.client.get("/api/users", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+        etag = response["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/users", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        [query] = data_queries(context)
+        assert '"apis_namespaceversion"' in query["sql"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                author_id=self.user2.id, receiver_id=self.user.id, content="FooBar")
+        response = self.client.get("/api/users", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+
 class TestResetPassword(APITestCase):
     def setUp(self):
         user = User.objects.create_user("hello@world", "hello_world_123")
@@ -195,7 +247,7 @@ class TestResetPassword(APITestCase):
         assert response.status_code == 204
 
 
-class TestUpdateUser(APITestCase):
+class TestUpdateUser(TemporaryMediaMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
             "hello@foo.bar", "foobar12345", bio="foobar"
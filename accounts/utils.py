@@ -16,12 +16,12 @@ def create_user_account(email, password, **extra_fields):
     return user
 
 
-def temporary_image():
+def temporary_image(size=(100, 100)):
     import tempfile
 
     from PIL import Image
 
-    image = Image.new("RGB", (100, 100))
+    image = Image.new("RGB", size)
     tmp_file = tempfile.NamedTemporaryFile(suffix=".jpg")
     image.save(tmp_file, "jpeg")
     tmp_file.seek(0)
@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model, login, logout
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -8,6 +9,13 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.validators import ValidationError
 
+from apis.conditional import (
+    aggregate_validators,
+    conditional_response,
+    namespace_validators,
+)
+from apis.models import Comment, Garden
+
 from . import serializers
 from .utils import create_user_account, get_and_authenticate_user
 
@@ -109,7 +117,13 @@ class UserViewSet(viewsets.ViewSet):
     ]
 
     parser_classes = (JSONParser, MultiPartParser, FormParser)
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related(
+        Prefetch("gardens", queryset=Garden.objects.for_listing()),
+        Prefetch(
+            "receiver_comments",
+            queryset=Comment.objects.select_related("author"),
+        ),
+    )
 
     def get_permissions(self):
         if self.action == "update" or self.action == "delete":
@@ -119,13 +133,31 @@ class UserViewSet(viewsets.ViewSet):
         return [permission() for permission in permission_classes]
 
     def list(self, request):
+        values = namespace_validators(["users"])
+        return conditional_response(request, values, lambda: self.render_list(request))
+
+    def render_list(self, request):
         serializer = serializers.AuthUserSerializer(
             self.queryset, many=True, context={"request": request}
         )
         return Response(serializer.data)
 
     def retrieve(self, request, pk=None):
+        user = User.objects.filter(pk=pk).values_list("updated_at").first()
+        if user is None:
+            return self.render_detail(request, pk)
+        values = (
+            user
+            + aggregate_validators(
+                Garden.objects.filter(user_id=pk), ["updated_at"])
+            + aggregate_validators(
+                Comment.objects.filter(receiver_id=pk),
+                ["updated_at", "author__updated_at"])
+        )
+        return conditional_response(
+            request, values, lambda: self.render_detail(request, pk))
 
+    def render_detail(self, request, pk):
         user = get_object_or_404(self.queryset, pk=pk)
         serializer = serializers.AuthUserSerializer(user, context={"request": request})
         return Response(serializer.data)
@@ -1,9 +1,12 @@
 from django.contrib import admin
 
-from .models import Comment, Conversation, Garden, Message, Photo
+from .models import (Comment, Conversation, Garden, Job, Message, Photo,
+                     StoredFile)
 
 admin.site.register(Garden)
 admin.site.register(Photo)
 admin.site.register(Comment)
 admin.site.register(Conversation)
 admin.site.register(Message)
+admin.site.register(StoredFile)
+admin.site.register(Job)
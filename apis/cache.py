@@ -0,0 +1,148 @@
+"""Shared response cache for anonymous reads of public resources.
+
+Cached pages are stored under a per-namespace generation number. Any
+write to a model a namespace depends on bumps the generation, which
+orphans every page cached before it, so a stale page can't be served
+after a write. The bump happens immediately and again when the
+transaction commits, so pages rendered from pre-commit data while the
+write was in flight are orphaned as well.
+
+Once the write commits, invalidating also bumps the namespace's
+NamespaceVersion row, which conditional list requests use as their
+validators instead of aggregating over the whole table. The row is
+updated outside the write's transaction, so concurrent writers to a
+namespace don't queue on its lock until they commit.
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from .models import NamespaceVersion
+
+CACHE_ALIAS = "default"
+KEY_PREFIX = "response-cache"
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def is_shared():
+    """Whether writes to the cache are seen by the other processes."""
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def initial_generation():
+    # Start from the clock rather than 1, so that a generation evicted from
+    # the cache doesn't come back with a number it already handed out.
+    return time.time_ns() // 1000
+
+
+def get_generation(namespace):
+    key = f"{KEY_PREFIX}:{namespace}:generation"
+    cache = get_cache()
+    generation = cache.get(key)
+    if generation is None:
+        generation = initial_generation()
+        cache.add(key, generation, timeout=None)
+        generation = cache.get(key, generation)
+    return generation
+
+
+def bump_generation(namespace):
+    key = f"{KEY_PREFIX}:{namespace}:generation"
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, initial_generation(), timeout=None)
+
+
+def invalidate(*namespaces):
+    for namespace in namespaces:
+        bump_generation(namespace)
+    transaction.on_commit(lambda: invalidate_committed(namespaces))
+
+
+def invalidate_committed(namespaces):
+    NamespaceVersion.bump(namespaces)
+    for namespace in namespaces:
+        bump_generation(namespace)
+
+
+def record(namespace, outcome):
+    key = f"{KEY_PREFIX}:{namespace}:{outcome}"
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_stats(namespace):
+    cache = get_cache()
+    return {
+        outcome: cache.get(f"{KEY_PREFIX}:{namespace}:{outcome}", 0)
+        for outcome in ("hits", "misses")
+    }
+
+
+class CachedReadMixin:
+    """Serve list and retrieve to anonymous users from the shared cache.
+
+    Views set ``cache_namespace`` to the namespace invalidated by writes to
+    the models they render, see apis/signals.py. Validators set by the
+    wrapped view are cached too, so conditional requests are answered from
+    the cache as well.
+    """
+
+    cache_namespace = None
+    cache_timeout = 60 * 60
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, render, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return render(request, *args, **kwargs)
+
+        # The generation must be read before querying, so that a page built
+        # from data older than a write is never stored under a newer one.
+        generation = get_generation(self.cache_namespace)
+        url = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+        key = f"{KEY_PREFIX}:{self.cache_namespace}:{generation}:{url}"
+        cache = get_cache()
+
+        cached = cache.get(key)
+        if cached is not None:
+            record(self.cache_namespace, "hits")
+            data, headers = cached
+            response = get_conditional_response(
+                request,
+                etag=headers.get("ETag"),
+                last_modified=parse_http_date_safe(headers.get("Last-Modified", "")),
+            ) or Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            response["X-Cache"] = "HIT"
+            return response
+
+        record(self.cache_namespace, "misses")
+        response = render(request, *args, **kwargs)
+        if response.status_code == 200:
+            headers = {
+                header: response[header]
+                for header in ("ETag", "Last-Modified") if header in response
+            }
+            cache.set(key, (response.data, headers), self.cache_timeout)
+        response["X-Cache"] = "MISS"
+        return response
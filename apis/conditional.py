@@ -0,0 +1,92 @@
+"""ETag/Last-Modified handling that answers 304 before serializing."""
+import hashlib
+from datetime import datetime
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import NamespaceVersion
+
+
+def get_validators(request, values):
+    """ETag and Last-Modified timestamp of a representation of values."""
+    fingerprint = "|".join([
+        request.get_full_path(),
+        request.META.get("HTTP_ACCEPT", ""),
+        repr(values),
+    ])
+    etag = '"%s"' % hashlib.md5(fingerprint.encode()).hexdigest()
+    timestamps = [value for value in values if isinstance(value, datetime)]
+    last_modified = int(max(timestamps).timestamp()) if timestamps else None
+    return etag, last_modified
+
+
+def conditional_response(request, values, render):
+    """Return 304 if the client's copy of values is fresh, else render()."""
+    etag, last_modified = get_validators(request, values)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render()
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def namespace_validators(namespaces):
+    """Version and last write time of response cache namespaces.
+
+    Both change once every write the namespaces are invalidated by
+    commits, see apis/signals.py, without querying the tables they cover.
+    """
+    versions = NamespaceVersion.objects.filter(
+        namespace__in=namespaces).order_by("namespace")
+    values = ()
+    for row in versions.values_list("namespace", "version", "updated_at"):
+        values += row
+    return values
+
+
+def aggregate_validators(queryset, fields):
+    """Row count and latest value of each field, changed by any write."""
+    aggregates = {"count": Count("pk")}
+    for field in fields:
+        aggregates[f"{field}_max"] = Max(field)
+    return tuple(queryset.order_by().aggregate(**aggregates).values())
+
+
+class ConditionalGetMixin:
+    """Answer conditional list and retrieve requests without serializing.
+
+    ``conditional_fields`` lists the timestamps that change whenever the
+    rendered representation of an object changes, including those of
+    embedded objects. Lists are validated by ``conditional_namespaces``,
+    the response cache namespaces invalidated by writes to anything they
+    render, so that no request aggregates over the whole table.
+    """
+
+    conditional_fields = ("updated_at",)
+    conditional_namespaces = ()
+
+    def list(self, request, *args, **kwargs):
+        values = namespace_validators(self.conditional_namespaces)
+        return conditional_response(
+            request, values, lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        values = (
+            self.filter_queryset(self.get_queryset())
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            .values_list(*self.conditional_fields)
+            .first()
+        )
+        render = lambda: super(ConditionalGetMixin, self).retrieve(  # noqa: E731
+            request, *args, **kwargs)
+        if values is None:
+            return render()
+        return conditional_response(request, values, render)
@@ -0,0 +1,132 @@
+"""Modern encodings of served images, picked from the Accept header.
+
+Each JPEG or PNG served from the media index can get a WebP copy, and an
+AVIF one when Pillow has an AVIF encoder. Copies are named after the
+checksum of their source, so that an image is encoded once whatever its
+name, and only kept when they are smaller than their source. Formats that
+weren't smaller are recorded on the source, so they aren't tried again.
+"""
+import io
+import logging
+import mimetypes
+import posixpath
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .models import StoredFile
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS_DIRECTORY = "apis/images/encodings"
+
+# Best format first.
+FORMATS = {
+    "AVIF": {"content_type": "image/avif", "extension": "avif",
+             "options": {"quality": 60}},
+    "WEBP": {"content_type": "image/webp", "extension": "webp",
+             "options": {"quality": 80, "method": 4}},
+}
+
+SOURCE_CONTENT_TYPES = {"image/jpeg", "image/png"}
+
+
+def content_type(name):
+    extension = posixpath.splitext(name)[1].lower().lstrip(".")
+    for options in FORMATS.values():
+        if options["extension"] == extension:
+            return options["content_type"]
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def supported_formats():
+    Image.init()
+    return [image_format for image_format in FORMATS if image_format in Image.SAVE]
+
+
+def encoding_name(checksum, image_format):
+    extension = FORMATS[image_format]["extension"]
+    return posixpath.join(ENCODINGS_DIRECTORY, f"{checksum}.{extension}")
+
+
+def encode(storage, names):
+    """Write the missing encodings of the stored files named names."""
+    sources = StoredFile.objects.filter(name__in=names).exclude(checksum="")
+    image_formats = supported_formats()
+    wanted = {
+        encoding_name(source.checksum, image_format)
+        for source in sources for image_format in image_formats
+    }
+    existing = set(StoredFile.objects.filter(name__in=wanted).values_list(
+        "name", flat=True))
+    for source in sources:
+        missing = [image_format for image_format in image_formats
+                   if encoding_name(source.checksum, image_format) not in existing
+                   and image_format not in source.rejected_encodings]
+        if missing:
+            encode_file(storage, source, missing)
+
+
+def encode_file(storage, source, image_formats):
+    with storage.open(source.name) as file, Image.open(file) as image:
+        if image.format not in ("JPEG", "PNG"):
+            return
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.mode or
+                                  "transparency" in image.info else "RGB")
+        rejected = []
+        for image_format in image_formats:
+            output = io.BytesIO()
+            image.save(output, image_format, **FORMATS[image_format]["options"])
+            if output.tell() >= source.size:
+                logger.info("Not keeping %s as %s, which isn't smaller",
+                            source.name, image_format)
+                rejected.append(image_format)
+                continue
+            name = encoding_name(source.checksum, image_format)
+            storage.delete(name)
+            storage.save(name, ContentFile(output.getvalue()))
+    if rejected:
+        # Encodings are shared by every file with the same content.
+        StoredFile.objects.filter(checksum=source.checksum).update(
+            rejected_encodings=sorted({*source.rejected_encodings, *rejected}))
+
+
+def accepted_types(accept):
+    """The media types of an Accept header with a non-zero quality."""
+    types = set()
+    for media_range in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            types.add(media_type.lower())
+    return types
+
+
+def negotiate(request, source):
+    """The name of the best encoding of source the client accepts, if any.
+
+    Wildcards don't count: clients have to name the modern formats they
+    support, as browsers do.
+    """
+    accepted = accepted_types(request.headers.get("Accept"))
+    candidates = [
+        encoding_name(source.checksum, image_format)
+        for image_format in supported_formats()
+        if FORMATS[image_format]["content_type"] in accepted
+    ]
+    if not candidates or not source.checksum:
+        return None
+    available = {
+        stored_file.name: stored_file
+        for stored_file in StoredFile.objects.filter(name__in=candidates)
+    }
+    return next((available[name] for name in candidates if name in available), None)
@@ -0,0 +1,81 @@
+import logging
+import warnings
+
+from django.conf import settings
+from PIL import Image
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Formats are restricted before the file is opened, so that Pillow doesn't
+# try every decoder it has on untrusted input. JPEG includes MPO.
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP", "GIF")
+DRAFT_FORMATS = ("JPEG", "MPO")
+
+
+# Bytes per pixel of Pillow's storage: 8-bit and 16-bit single-band modes
+# are stored as such, every other mode in 32-bit pixels.
+PIXEL_SIZES = {"1": 1, "L": 1, "P": 1,
+               "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2}
+
+
+def decoded_size(image):
+    width, height = image.size
+    return width * height * PIXEL_SIZES.get(image.mode, 4)
+
+
+class BoundedImageField(serializers.ImageField):
+    """ImageField that checks an upload within bounded memory.
+
+    The file size and the pixel count read from the header are checked
+    before anything is decoded. Images over IMAGE_DECODE_MAX_PIXELS are
+    then decoded at a reduced scale when their format allows it, or only
+    verified otherwise. The size of the decoded pixels is logged.
+    """
+
+    default_error_messages = {
+        **serializers.ImageField.default_error_messages,
+        "too_large": "Ensure this file is at most {max_size} bytes.",
+        "too_many_pixels": "Ensure this image has at most {max_pixels} pixels.",
+    }
+
+    def to_internal_value(self, data):
+        file = serializers.FileField.to_internal_value(self, data)
+        if file.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail("too_large", max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+        try:
+            self.check_image(file)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError,
+                Image.DecompressionBombWarning):
+            self.fail("invalid_image")
+        finally:
+            file.seek(0)
+        return file
+
+    def check_image(self, file):
+        file.seek(0)
+        Image.init()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            image = Image.open(file, formats=IMAGE_FORMATS)
+        with image:
+            width, height = image.size
+            pixels = width * height
+            if pixels > settings.IMAGE_UPLOAD_MAX_PIXELS:
+                self.fail("too_many_pixels",
+                          max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS)
+            scale = (settings.IMAGE_DECODE_MAX_PIXELS / pixels) ** 0.5
+            if scale >= 1:
+                image.load()
+            elif image.format in DRAFT_FORMATS:
+                image.draft(image.mode, (round(width * scale),
+                                         round(height * scale)))
+                image.load()
+            else:
+                # Checks the structure of the file without decoding pixels.
+                image.verify()
+            logger.info(
+                "Checked %s: %s bytes, %sx%s %s, %s bytes decoded",
+                file.name, file.size, width, height, image.format,
+                decoded_size(image) if image.im else 0,
+            )
@@ -0,0 +1,90 @@
+"""Offline zipcode geocoding and grid helpers for proximity search.
+
+Zipcode centroids come from the bundled ``data/zipcodes.csv`` table,
+which ``manage.py build_zipcode_table`` regenerates from the official
+postcode dataset. Gardens store their coordinates and a grid cell id at
+write time, so a radius search only reads the few cells covering the
+search area before computing distances.
+"""
+import csv
+import math
+from functools import lru_cache
+from pathlib import Path
+
+from django.db.models import F
+from django.db.models.functions import Sqrt
+
+ZIPCODES_PATH = Path(__file__).resolve().parent / "data" / "zipcodes.csv"
+
+# Grid cells are 0.1 degree wide, about 11 km north-south and 7 km
+# east-west in metropolitan France.
+GRID_SIZE = 0.1
+GRID_COLUMNS = int(360 / GRID_SIZE) + 1
+
+KM_PER_DEGREE_LATITUDE = 110.574
+KM_PER_DEGREE_LONGITUDE = 111.320
+
+MAX_RADIUS_KM = 50
+
+
+@lru_cache(maxsize=None)
+def zipcode_centroids():
+    with open(ZIPCODES_PATH, newline="") as zipcodes_file:
+        return {
+            row["zipcode"]: (float(row["latitude"]), float(row["longitude"]))
+            for row in csv.DictReader(zipcodes_file)
+        }
+
+
+def locate_zipcode(zipcode):
+    """Return the (latitude, longitude) centroid of a zipcode, or None."""
+    return zipcode_centroids().get(zipcode)
+
+
+def grid_cell(latitude, longitude):
+    row = math.floor((latitude + 90) / GRID_SIZE)
+    column = math.floor((longitude + 180) / GRID_SIZE)
+    return row * GRID_COLUMNS + column
+
+
+def bounding_box(latitude, longitude, radius_km):
+    delta_latitude = radius_km / KM_PER_DEGREE_LATITUDE
+    delta_longitude = radius_km / (
+        KM_PER_DEGREE_LONGITUDE * math.cos(math.radians(latitude)))
+    return (
+        latitude - delta_latitude,
+        latitude + delta_latitude,
+        longitude - delta_longitude,
+        longitude + delta_longitude,
+    )
+
+
+def grid_cells(latitude, longitude, radius_km):
+    """Ids of every grid cell intersecting the search bounding box."""
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(
+        latitude, longitude, radius_km)
+    first_row, last_row = (
+        math.floor((min_latitude + 90) / GRID_SIZE),
+        math.floor((max_latitude + 90) / GRID_SIZE),
+    )
+    first_column, last_column = (
+        math.floor((min_longitude + 180) / GRID_SIZE),
+        math.floor((max_longitude + 180) / GRID_SIZE),
+    )
+    return [
+        row * GRID_COLUMNS + column
+        for row in range(first_row, last_row + 1)
+        for column in range(first_column, last_column + 1)
+    ]
+
+
+def distance_km(latitude, longitude):
+    """Equirectangular distance from a point to the row's coordinates.
+
+    Accurate to well under 1% at the radiuses we search, and built from
+    plain arithmetic so it runs on any database backend.
+    """
+    x = (F("longitude") - longitude) * (
+        KM_PER_DEGREE_LONGITUDE * math.cos(math.radians(latitude)))
+    y = (F("latitude") - latitude) * KM_PER_DEGREE_LATITUDE
+    return Sqrt(x * x + y * y)
@@ -0,0 +1,135 @@
+"""A job queue backed by the Job table, so no broker is needed.
+
+Handlers are registered per kind with the handler decorator, and jobs are
+enqueued inside the caller's transaction: a worker only sees them once it
+commits. run_jobs claims jobs with SELECT ... FOR UPDATE SKIP LOCKED, so
+several workers can share the queue.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+VISIBILITY_TIMEOUT = timedelta(minutes=5)
+RETRY_DELAY = timedelta(seconds=30)
+ABANDONED_ERROR = "The worker stopped during the last attempt."
+
+handlers = {}
+
+
+def handler(kind, on_failure=None):
+    """Register a function run with the payload of each job of that kind.
+
+    on_failure is called with the payload once the job has exhausted its
+    attempts.
+    """
+
+    def register(function):
+        handlers[kind] = (function, on_failure)
+        return function
+
+    return register
+
+
+def enqueue(kind, **payload):
+    if kind not in handlers:
+        raise ValueError(f"No handler registered for {kind} jobs")
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def enqueue_many(kind, payloads):
+    if kind not in handlers:
+        raise ValueError(f"No handler registered for {kind} jobs")
+    return Job.objects.bulk_create(
+        [Job(kind=kind, payload=payload) for payload in payloads])
+
+
+def claim(limit=1, visibility_timeout=VISIBILITY_TIMEOUT):
+    """Lock up to limit available jobs for this worker.
+
+    Jobs whose worker died during their last attempt are marked as failed
+    instead of being handed out again.
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(status__in=[Job.Status.QUEUED, Job.Status.RUNNING],
+                        available_at__lte=now)
+                .order_by("available_at", "id")[:limit]
+            )
+            exhausted = [job for job in jobs if job.attempts >= job.max_attempts]
+            jobs = [job for job in jobs if job.attempts < job.max_attempts]
+            for job in exhausted:
+                job.status = Job.Status.FAILED
+                job.last_error = "\n".join(filter(None, [job.last_error, ABANDONED_ERROR]))
+                job.save(update_fields=["status", "last_error", "updated_at"])
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=Job.Status.RUNNING,
+                available_at=now + visibility_timeout,
+                attempts=F("attempts") + 1,
+                updated_at=now,
+            )
+        for job in exhausted:
+            logger.error("Job %s failed: %s", job, ABANDONED_ERROR)
+            fail(job)
+        if jobs or not exhausted:
+            break
+    for job in jobs:
+        job.attempts += 1
+    return jobs
+
+
+def run(job):
+    function, on_failure = handlers[job.kind]
+    try:
+        function(**job.payload)
+    except Exception:
+        logger.exception("Job %s failed", job)
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.Status.QUEUED
+            job.available_at = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            job.status = Job.Status.FAILED
+    else:
+        job.status = Job.Status.DONE
+    job.save(update_fields=["status", "available_at", "last_error", "updated_at"])
+    if job.status == Job.Status.FAILED:
+        fail(job)
+    return job.status
+
+
+def fail(job):
+    """Call the on_failure hook of a job that has exhausted its attempts.
+
+    The job is already saved as failed: an error in the hook is logged
+    rather than leaving it to be claimed again.
+    """
+    on_failure = handlers[job.kind][1]
+    if on_failure is None:
+        return
+    try:
+        on_failure(**job.payload)
+    except Exception:
+        logger.exception("on_failure of job %s failed", job)
+
+
+def run_pending(limit=None, visibility_timeout=VISIBILITY_TIMEOUT):
+    """Run available jobs until there are none left, or limit is reached."""
+    count = 0
+    while limit is None or count < limit:
+        jobs = claim(visibility_timeout=visibility_timeout)
+        if not jobs:
+            break
+        run(jobs[0])
+        count += 1
+    return count
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from accounts.models import User
+from apis import geo
+from apis.models import Garden
+
+# Metropolitan France
+MIN_LATITUDE, MAX_LATITUDE = 42.3, 51.1
+MIN_LONGITUDE, MAX_LONGITUDE = -4.8, 8.2
+
+
+class Command(BaseCommand):
+    help = (
+        "Time proximity searches over synthetic gardens. The gardens are "
+        "inserted in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--gardens", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--radius-km", type=float, default=5)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        with transaction.atomic():
+            self.seed_gardens(options["gardens"], options["batch_size"])
+            self.run_queries(options["queries"], options["radius_km"])
+            transaction.set_rollback(True)
+
+    def seed_gardens(self, count, batch_size):
+        user = User.objects.create_user(
+            "proximity-benchmark@example.com", None)
+        zipcodes = list(geo.zipcode_centroids())
+        started = time.perf_counter()
+        for start in range(0, count, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, count)):
+                latitude = self.random.uniform(MIN_LATITUDE, MAX_LATITUDE)
+                longitude = self.random.uniform(MIN_LONGITUDE, MAX_LONGITUDE)
+                batch.append(Garden(
+                    user=user,
+                    title=f"Garden {i}",
+                    address="",
+                    zipcode=self.random.choice(zipcodes),
+                    latitude=latitude,
+                    longitude=longitude,
+                    geo_cell=geo.grid_cell(latitude, longitude),
+                ))
+            Garden.objects.bulk_create(batch)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Garden._meta.db_table}")
+        self.stdout.write(
+            f"Seeded {count} gardens in {time.perf_counter() - started:.1f}s")
+
+    def run_queries(self, count, radius_km):
+        timings, results = [], []
+        for i in range(count):
+            latitude = self.random.uniform(MIN_LATITUDE, MAX_LATITUDE)
+            longitude = self.random.uniform(MIN_LONGITUDE, MAX_LONGITUDE)
+            queryset = Garden.objects.near(latitude, longitude, radius_km)
+            started = time.perf_counter()
+            page = list(queryset[:10])
+            timings.append(time.perf_counter() - started)
+            results.append(len(page))
+
+        timings.sort()
+        self.stdout.write(
+            f"{count} searches within {radius_km} km: "
+            f"median {statistics.median(timings) * 1000:.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.2f} ms, "
+            f"{statistics.mean(results):.1f} results per page on average"
+        )
+        self.stdout.write(queryset[:10].explain())
@@ -0,0 +1,92 @@
+import contextlib
+import csv
+import io
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from apis import geo
+
+# "Communes de France - Base des codes postaux" on data.gouv.fr, with one
+# row per commune and its coordinates.
+OFFICIAL_SOURCE_URL = (
+    "https://www.data.gouv.fr/fr/datasets/r/dbe8a621-a9c4-4bc3-9cae-be1699c5ff25"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the bundled zipcode centroid table from a postcode CSV with one "
+        "row per commune, such as the La Poste/INSEE communes dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source",
+            nargs="?",
+            default=OFFICIAL_SOURCE_URL,
+            help="Path or URL of the source CSV file, the official dataset by default.",
+        )
+        parser.add_argument("--zipcode-column", default="code_postal")
+        parser.add_argument("--latitude-column", default="latitude")
+        parser.add_argument("--longitude-column", default="longitude")
+        parser.add_argument("--delimiter", default=",")
+        parser.add_argument("--output", default=str(geo.ZIPCODES_PATH))
+        parser.add_argument(
+            "--no-relocate",
+            action="store_true",
+            help="Don't update existing gardens from the new table.",
+        )
+
+    def handle(self, *args, **options):
+        # zipcode -> [latitude sum, longitude sum, commune count]
+        totals = defaultdict(lambda: [0.0, 0.0, 0])
+        with open_source(options["source"]) as source:
+            reader = csv.DictReader(source, delimiter=options["delimiter"])
+            for row in reader:
+                try:
+                    zipcode = row[options["zipcode_column"]].strip().zfill(5)
+                    latitude = float(row[options["latitude_column"]])
+                    longitude = float(row[options["longitude_column"]])
+                except KeyError as error:
+                    raise CommandError(f"Missing column {error} in {options['source']}")
+                except ValueError:
+                    continue
+                total = totals[zipcode]
+                total[0] += latitude
+                total[1] += longitude
+                total[2] += 1
+
+        with open(options["output"], "w", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(["zipcode", "latitude", "longitude"])
+            for zipcode in sorted(totals):
+                latitude, longitude, count = totals[zipcode]
+                writer.writerow([
+                    zipcode, f"{latitude / count:.4f}", f"{longitude / count:.4f}"])
+
+        geo.zipcode_centroids.cache_clear()
+        self.stdout.write(f"{len(totals)} zipcodes written to {options['output']}")
+
+        if (
+            not options["no_relocate"]
+            and Path(options["output"]).resolve() == geo.ZIPCODES_PATH.resolve()
+        ):
+            call_command("relocate_gardens", stdout=self.stdout)
+
+
+@contextlib.contextmanager
+def open_source(source):
+    if source.startswith(("http://", "https://")):
+        try:
+            response = urllib.request.urlopen(source, timeout=60)
+        except OSError as error:
+            raise CommandError(f"Can't download {source}: {error}")
+        with response:
+            yield io.TextIOWrapper(response, encoding="utf-8-sig", newline="")
+    else:
+        with open(source, newline="", encoding="utf-8-sig") as source_file:
+            yield source_file
@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apis import variants
+from apis.models import StoredFile
+from apis.storage import is_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the content-addressed files that no photo or user has "
+        "referenced for a while, along with their variants and encodings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="How long a file must have been unreferenced to be deleted.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="List the files that would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        unreferenced = StoredFile.objects.filter(ref_count=0, updated_at__lte=cutoff)
+        count = 0
+        for stored_file in unreferenced.only("name", "checksum").iterator():
+            # Files uploaded before content addressing may be shared defaults,
+            # and variants and encodings go along with their source.
+            if not is_upload(stored_file.name):
+                continue
+            if options["dry_run"]:
+                self.stdout.write(stored_file.name)
+                count += 1
+                continue
+            # Skip the file if it was referenced again in the meantime. The
+            # file is deleted before the row's deletion commits, so that an
+            # upload of the same content waits for it and then writes the
+            # file again, see ContentAddressedStorage._save.
+            with transaction.atomic():
+                deleted, _ = unreferenced.filter(pk=stored_file.pk).delete()
+                if deleted:
+                    default_storage.delete(stored_file.name)
+                    for derived in variants.derived_files(stored_file):
+                        default_storage.delete(derived.name)
+                    count += 1
+        self.stdout.write(f"{count} unreferenced files deleted"
+                          if not options["dry_run"] else
+                          f"{count} unreferenced files would be deleted")
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from apis import encodings
+from apis.models import Photo
+from apis.variants import IMAGE_FIELDS, expire_responses, refresh_variants
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized variants and modern encodings of photos and "
+        "profile images that lack them, without going through the job queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate the variants of every image, even up-to-date ones.",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        self.force = options["force"]
+        self.batch_size = options["batch_size"]
+
+        photos = self.backfill(Photo)
+        users = self.backfill(User)
+
+        self.stdout.write(f"{photos} photos and {users} profile images updated")
+
+    def backfill(self, model):
+        field_name, variants_field, status_field = IMAGE_FIELDS[model._meta.label]
+        queryset = model.objects.only(field_name, variants_field, status_field)
+        updated = 0
+        batch = []
+        for instance in queryset.order_by("pk").iterator(chunk_size=self.batch_size):
+            file = getattr(instance, field_name)
+            variants = getattr(instance, variants_field)
+            try:
+                if not self.force and variants.get("source") == file.name:
+                    # Images processed before their encodings were added.
+                    encodings.encode(file.storage, [
+                        file.name, *variants.get("sizes", {}).values()])
+                    continue
+                refresh_variants(instance, overwrite=self.force)
+            except Exception as error:
+                self.stderr.write(f"{file.name}: {error}")
+                continue
+            batch.append(instance.pk)
+            if len(batch) >= self.batch_size:
+                expire_responses(model, batch)
+                updated += len(batch)
+                batch = []
+        if batch:
+            expire_responses(model, batch)
+        return updated + len(batch)
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apis import uploads
+from apis.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete the upload sessions, and their part files, untouched for a while."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="Age, since their last chunk, of the sessions to delete.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        sessions = UploadSession.objects.filter(updated_at__lt=cutoff)
+        count = 0
+        for session in sessions.iterator():
+            uploads.delete_part(session)
+            count += 1
+        sessions.delete()
+        self.stdout.write(f"{count} upload sessions deleted")
@@ -0,0 +1,82 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from apis import cache
+from apis.models import StoredFile
+from apis.storage import count_references, file_checksum, upload_directories
+
+
+class Command(BaseCommand):
+    help = "Rebuild the StoredFile index by walking the upload directories of MEDIA_ROOT."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Recompute the checksum of files already indexed with the same size.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.verify = options["verify"]
+        self.batch_size = options["batch_size"]
+        self.added = self.updated = self.removed = 0
+
+        batch = []
+        for name in self.walk():
+            batch.append(name)
+            if len(batch) >= self.batch_size:
+                self.index(batch)
+                batch = []
+        self.index(batch)
+        self.prune()
+        count_references()
+        # Bulk writes don't send the signals the response cache listens to.
+        cache.invalidate("gardens", "users")
+
+        self.stdout.write(
+            f"{self.added} added, {self.updated} updated, {self.removed} removed"
+        )
+
+    def walk(self):
+        root = default_storage.path("")
+        for directory in upload_directories():
+            for dirpath, dirnames, filenames in os.walk(os.path.join(root, directory)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path, root).replace(os.sep, "/")
+
+    def index(self, names):
+        known = StoredFile.objects.in_bulk(names, field_name="name")
+        to_create, to_update = [], []
+        for name in names:
+            size = default_storage.size(name)
+            stored_file = known.get(name)
+            if stored_file and stored_file.size == size and not self.verify:
+                continue
+            with default_storage.open(name) as content:
+                checksum = file_checksum(content)
+            if stored_file is None:
+                to_create.append(StoredFile(name=name, size=size, checksum=checksum))
+            elif (stored_file.size, stored_file.checksum) != (size, checksum):
+                stored_file.size, stored_file.checksum = size, checksum
+                stored_file.rejected_encodings = []
+                to_update.append(stored_file)
+        StoredFile.objects.bulk_create(to_create, ignore_conflicts=True)
+        StoredFile.objects.bulk_update(
+            to_update, ["size", "checksum", "rejected_encodings"])
+        self.added += len(to_create)
+        self.updated += len(to_update)
+
+    def prune(self):
+        missing = [
+            stored_file.pk
+            for stored_file in StoredFile.objects.only("name").iterator(
+                chunk_size=self.batch_size)
+            if not default_storage.exists(stored_file.name)
+        ]
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            self.removed += StoredFile.objects.filter(pk__in=chunk).delete()[0]
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from apis import cache, geo
+from apis.models import Garden
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the coordinates and grid cell of existing gardens from the "
+        "zipcode centroid table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of zipcodes updated per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        zipcodes = list(
+            Garden.objects.order_by("zipcode").values_list("zipcode", flat=True).distinct()
+        )
+        relocated = 0
+        for start in range(0, len(zipcodes), options["batch_size"]):
+            with transaction.atomic():
+                for zipcode in zipcodes[start:start + options["batch_size"]]:
+                    relocated += self.relocate(zipcode)
+        if relocated:
+            # update() doesn't send the signals the response cache listens to.
+            cache.invalidate("gardens")
+        self.stdout.write(f"{relocated} gardens relocated")
+
+    def relocate(self, zipcode):
+        centroid = geo.locate_zipcode(zipcode)
+        if centroid is None:
+            location = {"latitude": None, "longitude": None, "geo_cell": None}
+            stale = Q(latitude__isnull=False) | Q(geo_cell__isnull=False)
+        else:
+            location = {
+                "latitude": centroid[0],
+                "longitude": centroid[1],
+                "geo_cell": geo.grid_cell(*centroid),
+            }
+            stale = ~Q(**location)
+        return Garden.objects.filter(stale, zipcode=zipcode).update(**location)
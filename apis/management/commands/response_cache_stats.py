@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apis import cache
+
+
+class Command(BaseCommand):
+    help = "Show hit and miss counts of the shared response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("namespaces", nargs="*", default=["gardens", "photos"])
+
+    def handle(self, *args, **options):
+        for namespace in options["namespaces"]:
+            stats = cache.get_stats(namespace)
+            total = stats["hits"] + stats["misses"]
+            ratio = stats["hits"] / total if total else 0
+            self.stdout.write(
+                f"{namespace}: {stats['hits']} hits, {stats['misses']} misses "
+                f"({ratio:.0%} hit rate)"
+            )
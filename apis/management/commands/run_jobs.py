@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apis import cache, jobs
+
+
+class Command(BaseCommand):
+    help = "Run background jobs as they are queued."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no job is available instead of waiting for more.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before checking again an empty queue.",
+        )
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            default=int(jobs.VISIBILITY_TIMEOUT.total_seconds()),
+            help="Seconds after which a job claimed by a dead worker is retried.",
+        )
+
+    def handle(self, *args, **options):
+        if not cache.is_shared():
+            # Jobs invalidate cached pages, which the web process would
+            # keep serving from its own memory.
+            raise CommandError(
+                "The worker needs a cache shared with the web process, "
+                "set CACHE_URL to a database or redis cache.")
+        visibility_timeout = timedelta(seconds=options["visibility_timeout"])
+        total = 0
+        try:
+            while True:
+                count = jobs.run_pending(visibility_timeout=visibility_timeout)
+                total += count
+                if options["once"]:
+                    break
+                if not count:
+                    time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"{total} jobs run")
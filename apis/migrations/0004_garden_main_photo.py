@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_main_photos(apps, schema_editor):
+    Garden = apps.get_model("apis", "Garden")
+    Photo = apps.get_model("apis", "Photo")
+    for garden in Garden.objects.filter(photo__isnull=False).distinct().iterator():
+        photos = Photo.objects.filter(garden_id=garden.pk)
+        main_photo = photos.order_by("-is_main_photo", "pk").first()
+        photos.filter(is_main_photo=True).exclude(pk=main_photo.pk).update(
+            is_main_photo=False)
+        Garden.objects.filter(pk=garden.pk).update(main_photo=main_photo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0003_rename_conversationd_message_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='garden',
+            name='main_photo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='apis.photo'),
+        ),
+        migrations.RunPython(set_main_photos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0004_garden_main_photo'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='photo',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_main_photo', True)), fields=('garden',), name='unique_main_photo_per_garden'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+from apis import geo
+
+
+def locate_gardens(apps, schema_editor):
+    Garden = apps.get_model("apis", "Garden")
+    batch = []
+    for garden in Garden.objects.only("id", "zipcode").iterator(chunk_size=1000):
+        centroid = geo.locate_zipcode(garden.zipcode)
+        if centroid is None:
+            continue
+        garden.latitude, garden.longitude = centroid
+        garden.geo_cell = geo.grid_cell(*centroid)
+        batch.append(garden)
+        if len(batch) >= 1000:
+            Garden.objects.bulk_update(batch, ["latitude", "longitude", "geo_cell"])
+            batch = []
+    Garden.objects.bulk_update(batch, ["latitude", "longitude", "geo_cell"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0006_storedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='garden',
+            name='geo_cell',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='garden',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='garden',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(locate_gardens, migrations.RunPython.noop),
+    ]
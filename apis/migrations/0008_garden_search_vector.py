@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:08
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('french', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('french', coalesce({row}description, '')), 'B')
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"""
+        CREATE FUNCTION apis_garden_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR.format(row="NEW.")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute("""
+        CREATE TRIGGER apis_garden_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, description ON apis_garden
+        FOR EACH ROW EXECUTE PROCEDURE apis_garden_search_vector_update()
+    """)
+    schema_editor.execute(
+        f"UPDATE apis_garden SET search_vector = {SEARCH_VECTOR.format(row='')}")
+    schema_editor.execute(
+        "CREATE INDEX apis_garden_search_vector_gin ON apis_garden USING gin (search_vector)")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX apis_garden_search_vector_gin")
+    schema_editor.execute("DROP TRIGGER apis_garden_search_vector_trigger ON apis_garden")
+    schema_editor.execute("DROP FUNCTION apis_garden_search_vector_update()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0007_garden_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='garden',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
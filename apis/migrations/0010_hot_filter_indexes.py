@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0009_maintain_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['receiver', 'created_at', 'id'], name='apis_comment_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created_at', 'id'], name='apis_comment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['chat_sender', 'updated_at', 'id'], name='apis_conversation_sender_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['chat_receiver', 'updated_at', 'id'], name='apis_conversation_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='garden',
+            index=models.Index(fields=['zipcode'], name='apis_garden_zipcode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='garden',
+            index=models.Index(fields=['created_at', 'id'], name='apis_garden_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at', 'id'], name='apis_message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['garden', 'is_main_photo', 'id'], name='apis_photo_garden_main_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:33
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def count_references(apps, schema_editor):
+    StoredFile = apps.get_model("apis", "StoredFile")
+    referencing_fields = (
+        (apps.get_model("apis", "Photo"), "image"),
+        (apps.get_model("accounts", "User"), "profile_image"),
+    )
+    references = [
+        Coalesce(models.Subquery(
+            model.objects.filter(**{field: models.OuterRef("name")})
+            .order_by()
+            .values(field)
+            .annotate(count=models.Count("pk"))
+            .values("count")
+        ), 0)
+        for model, field in referencing_fields
+    ]
+    StoredFile.objects.update(ref_count=sum(references, models.Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_user_profile_image_status'),
+        ('apis', '0013_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='ref_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storedfile',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='storedfile',
+            name='checksum',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Left
+import django.db.models.deletion
+
+
+def snapshot_last_messages(apps, schema_editor):
+    Conversation = apps.get_model("apis", "Conversation")
+    Message = apps.get_model("apis", "Message")
+    latest = Message.objects.filter(
+        conversation=models.OuterRef("pk")).order_by("-sent_at", "-id")[:1]
+    Conversation.objects.update(
+        last_message=models.Subquery(latest.values("id")),
+        last_message_preview=Coalesce(
+            models.Subquery(latest.values(preview=Left("content", 255))),
+            models.Value("")),
+        last_message_sender=models.Subquery(latest.values("sender_id")),
+        last_message_at=models.Subquery(latest.values("sent_at")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('apis', '0014_storedfile_ref_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='apis.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(snapshot_last_messages, migrations.RunPython.noop),
+    ]
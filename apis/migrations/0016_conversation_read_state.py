@@ -0,0 +1,43 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+def mark_history_read(apps, schema_editor):
+    # There was no read state before: consider existing messages read.
+    Conversation = apps.get_model("apis", "Conversation")
+    Conversation.objects.update(
+        chat_sender_last_read_id=models.F("last_message"),
+        chat_receiver_last_read_id=models.F("last_message"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0015_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='chat_receiver_last_read_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='chat_receiver_unread',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='chat_sender_last_read_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='chat_sender_unread',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(mark_history_read, migrations.RunPython.noop),
+    ]
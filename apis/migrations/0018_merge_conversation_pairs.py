@@ -0,0 +1,58 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:08
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Greatest, Least, Left
+
+
+def merge_duplicate_pairs(apps, schema_editor):
+    Conversation = apps.get_model("apis", "Conversation")
+    Message = apps.get_model("apis", "Message")
+    Conversation.objects.update(
+        low_user=Least("chat_sender", "chat_receiver"),
+        high_user=Greatest("chat_sender", "chat_receiver"),
+    )
+    duplicates = (
+        Conversation.objects.order_by()
+        .values("low_user", "high_user")
+        .annotate(keep=models.Min("id"), count=models.Count("id"))
+        .filter(count__gt=1)
+    )
+    for pair in duplicates:
+        # Keep the oldest conversation of the pair, with every message.
+        others = Conversation.objects.filter(
+            low_user=pair["low_user"], high_user=pair["high_user"]
+        ).exclude(pk=pair["keep"])
+        Message.objects.filter(conversation__in=others).update(
+            conversation=pair["keep"])
+        others.delete()
+
+        latest = Message.objects.filter(
+            conversation=models.OuterRef("pk")).order_by("-sent_at", "-id")[:1]
+        # The merged read state can't be told apart: start it afresh.
+        Conversation.objects.filter(pk=pair["keep"]).update(
+            last_message=models.Subquery(latest.values("id")),
+            last_message_preview=Coalesce(
+                models.Subquery(latest.values(preview=Left("content", 255))),
+                models.Value("")),
+            last_message_sender=models.Subquery(latest.values("sender_id")),
+            last_message_at=models.Subquery(latest.values("sent_at")),
+        )
+        Conversation.objects.filter(pk=pair["keep"]).update(
+            chat_sender_last_read_id=models.F("last_message"),
+            chat_receiver_last_read_id=models.F("last_message"),
+            chat_sender_unread=0,
+            chat_receiver_unread=0,
+        )
+
+
+class Migration(migrations.Migration):
+    # Separate from the schema changes around it: Postgres refuses to alter
+    # a table with updates pending in the same transaction.
+
+    dependencies = [
+        ('apis', '0017_conversation_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_pairs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0019_conversation_pair_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='rejected_encodings',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
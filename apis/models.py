@@ -1,11 +1,58 @@
-from django.db import models
+import uuid
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce, Left
 from django.utils import timezone
 
-from accounts.models import User
+from accounts.models import ProcessingStatus, User
+
+from . import geo
 
 user = User
 
 
+class GardenQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Join the owner and the main photo so rendering a page of gardens
+        does not run extra queries per row. GardenSerializer checks which
+        main photos are stored for the whole page at once."""
+        return self.select_related("user", "main_photo")
+
+    def search(self, text):
+        """Gardens whose title or description match text, best match first.
+
+        Uses the french full-text index on Postgres, and a plain substring
+        match elsewhere.
+        """
+        if connections[self.db].vendor != "postgresql":
+            return self.filter(
+                models.Q(title__icontains=text) | models.Q(description__icontains=text)
+            ).order_by("-id")
+        query = SearchQuery(text, config="french", search_type="websearch")
+        return (
+            self.filter(search_vector=query)
+            .annotate(rank=SearchRank(models.F("search_vector"), query))
+            .order_by("-rank", "-id")
+        )
+
+    def near(self, latitude, longitude, radius_km):
+        """Gardens within radius_km of a point, closest first."""
+        min_latitude, max_latitude, min_longitude, max_longitude = geo.bounding_box(
+            latitude, longitude, radius_km)
+        return (
+            self.filter(
+                geo_cell__in=geo.grid_cells(latitude, longitude, radius_km),
+                latitude__range=(min_latitude, max_latitude),
+                longitude__range=(min_longitude, max_longitude),
+            )
+            .annotate(distance_km=geo.distance_km(latitude, longitude))
+            .filter(distance_km__lte=radius_km)
+            .order_by("distance_km", "id")
+        )
+
+
 class Garden(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="gardens")
@@ -14,17 +61,107 @@ class Garden(models.Model):
     address = models.TextField()
     zipcode = models.CharField(max_length=5)
     created_at = models.DateTimeField(default=timezone.now)
-    updated_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    main_photo = models.ForeignKey(
+        "Photo", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geo_cell = models.IntegerField(null=True, blank=True, db_index=True)
+    # Maintained by a database trigger on Postgres, see migration 0008.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = GardenQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["zipcode"], name="apis_garden_zipcode_idx"),
+            models.Index(fields=["created_at", "id"], name="apis_garden_created_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.locate()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = {*update_fields, "updated_at"}
+            if "zipcode" in update_fields:
+                update_fields |= {"latitude", "longitude", "geo_cell"}
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
+
+    def locate(self):
+        """Set the coordinates and grid cell from the zipcode centroid."""
+        centroid = geo.locate_zipcode(self.zipcode)
+        if centroid is None:
+            self.latitude = self.longitude = self.geo_cell = None
+        else:
+            self.latitude, self.longitude = centroid
+            self.geo_cell = geo.grid_cell(*centroid)
+
+    def refresh_main_photo(self):
+        """Point main_photo at the photo flagged as main, or at the oldest
+        photo of the garden when none is flagged."""
+        self.main_photo = self.photo_set.order_by("-is_main_photo", "pk").first()
+        self.updated_at = timezone.now()
+        Garden.objects.filter(pk=self.pk).update(
+            main_photo=self.main_photo, updated_at=self.updated_at)
+
 
 class Photo(models.Model):
     garden = models.ForeignKey(Garden, on_delete=models.CASCADE)
     image = models.ImageField(default="", upload_to="apis/images")
     is_main_photo = models.BooleanField()
     season = models.IntegerField(default=0)
+    # Resized copies of image, see apis.variants.
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    processing_status = models.CharField(
+        max_length=10, choices=ProcessingStatus.choices,
+        default=ProcessingStatus.READY, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["garden"],
+                condition=models.Q(is_main_photo=True),
+                name="unique_main_photo_per_garden",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["garden", "is_main_photo", "id"],
+                name="apis_photo_garden_main_idx",
+            ),
+        ]
+
+
+class UploadSession(models.Model):
+    """A photo sent in chunks, so that an interrupted upload can resume.
+
+    Chunks are appended to a part file in UPLOAD_DIRECTORY, and offset is
+    the number of bytes acknowledged so far.
+    """
+
+    UPLOAD_DIRECTORY = "apis/incoming"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    garden = models.ForeignKey(Garden, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    is_main_photo = models.BooleanField(default=False)
+    season = models.IntegerField(default=0)
+    photo = models.ForeignKey(
+        Photo, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def part_name(self):
+        return f"{self.UPLOAD_DIRECTORY}/{self.pk}.part"
 
 
 class Comment(models.Model):
@@ -36,7 +173,80 @@ class Comment(models.Model):
     )
     content = models.TextField(blank=False, null=False)
     created_at = models.DateTimeField(default=timezone.now)
-    updated_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["receiver", "created_at", "id"],
+                name="apis_comment_receiver_idx",
+            ),
+            models.Index(fields=["created_at", "id"], name="apis_comment_created_idx"),
+        ]
+
+
+class ConversationQuerySet(models.QuerySet):
+    def refresh_last_message(self):
+        """Recompute the latest-message snapshot from the messages table,
+        for when the message it pointed to is gone."""
+        latest = Message.objects.filter(
+            conversation=models.OuterRef("pk")).order_by("-sent_at", "-id")[:1]
+        return self.update(
+            last_message=models.Subquery(latest.values("id")),
+            last_message_preview=Coalesce(
+                models.Subquery(latest.values(preview=Left(
+                    "content", Message.PREVIEW_LENGTH))),
+                models.Value("")),
+            last_message_sender=models.Subquery(latest.values("sender_id")),
+            last_message_at=models.Subquery(latest.values("sent_at")),
+        )
+
+    def between(self, user_id, other_user_id):
+        """The conversation of two users, whoever started it: a single
+        lookup on the unique (low_user, high_user) index."""
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return self.filter(low_user_id=low, high_user_id=high)
+
+    def open(self, user_id, other_user_id):
+        """Get the conversation of two users or start it, as get_or_create
+        does: the unique pair makes concurrent calls agree on one row."""
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return self.get_or_create(
+            low_user_id=low,
+            high_user_id=high,
+            defaults={"chat_sender_id": user_id,
+                      "chat_receiver_id": other_user_id},
+        )
+
+    def for_participant(self, user):
+        return self.filter(models.Q(chat_sender=user) | models.Q(chat_receiver=user))
+
+    def mark_read(self, user):
+        """Mark everything up to the latest message as read by user, in a
+        single UPDATE. Returns the number of conversations updated."""
+        return self.for_participant(user).update(**{
+            f"{role}_{name}": models.Case(
+                models.When(**{role: user}, then=value),
+                default=models.F(f"{role}_{name}"),
+                output_field=Conversation._meta.get_field(f"{role}_{name}"),
+            )
+            for role in PARTICIPANTS
+            for name, value in (
+                ("last_read_id", models.F("last_message")),
+                ("unread", models.Value(0)),
+            )
+        })
+
+    def unread_total(self, user):
+        return self.for_participant(user).aggregate(total=Coalesce(models.Sum(
+            models.Case(
+                models.When(chat_sender=user, then="chat_sender_unread"),
+                default="chat_receiver_unread",
+            )), 0))["total"]
+
+
+# The two roles of a conversation, as field name prefixes.
+PARTICIPANTS = ("chat_sender", "chat_receiver")
 
 
 class Conversation(models.Model):
@@ -46,7 +256,59 @@ class Conversation(models.Model):
     chat_receiver = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="chat_receiver"
     )
+    # The participants in id order, set by save(), so that a pair of users
+    # has a single conversation whoever started it.
+    low_user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", editable=False,
+        db_index=False)  # Leads the unique pair index.
+    high_user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", editable=False)
     updated_at = models.DateTimeField(auto_now=True)
+    # Snapshot of the newest message, kept up to date by Message.save so
+    # the inbox renders without reading the messages table.
+    last_message = models.ForeignKey(
+        "Message", on_delete=models.SET_NULL, null=True, blank=True,
+        related_name="+", editable=False)
+    last_message_preview = models.CharField(
+        max_length=255, blank=True, editable=False)
+    last_message_sender = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name="+", editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Read state of each participant: the id of the last message they read,
+    # and how many arrived since. Maintained by Message.save and mark_read,
+    # so unread counts never need a COUNT over the messages table.
+    chat_sender_last_read_id = models.BigIntegerField(
+        null=True, blank=True, editable=False)
+    chat_receiver_last_read_id = models.BigIntegerField(
+        null=True, blank=True, editable=False)
+    chat_sender_unread = models.PositiveIntegerField(default=0, editable=False)
+    chat_receiver_unread = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["chat_sender", "updated_at", "id"],
+                name="apis_conversation_sender_idx",
+            ),
+            models.Index(
+                fields=["chat_receiver", "updated_at", "id"],
+                name="apis_conversation_receiver_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["low_user", "high_user"],
+                name="apis_conversation_pair_unique",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.low_user_id, self.high_user_id = sorted(
+            (self.chat_sender_id, self.chat_receiver_id))
+        super().save(*args, **kwargs)
 
 
 class Message(models.Model):
@@ -59,18 +321,200 @@ class Message(models.Model):
     content = models.TextField(null=False)
     sent_at = models.DateTimeField(default=timezone.now)
 
+    PREVIEW_LENGTH = 255
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "sent_at", "id"],
+                name="apis_message_conversation_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets save() tell what changed without reading the row.
+        instance._loaded_sent_at = instance.__dict__.get("sent_at")
+        instance._loaded_content = instance.__dict__.get("content")
+        return instance
+
+    @property
+    def preview(self):
+        return self.content[:self.PREVIEW_LENGTH]
+
+    def get_snapshot(self):
+        """The Conversation columns to SET for this message: it only
+        replaces the snapshot if it is at least as recent as the current
+        one, so concurrent writers cannot move it backwards."""
+        is_latest = (
+            models.Q(last_message__isnull=True)
+            | models.Q(last_message=self.pk)
+            | models.Q(last_message_at__lt=self.sent_at)
+            | models.Q(last_message_at=self.sent_at, last_message__lt=self.pk)
+        )
+        values = {
+            "last_message": self.pk,
+            "last_message_preview": self.preview,
+            "last_message_sender": self.sender_id,
+            "last_message_at": self.sent_at,
+        }
+        return {
+            name: models.Case(
+                models.When(is_latest, then=models.Value(value)),
+                default=models.F(name),
+                output_field=Conversation._meta.get_field(name),
+            )
+            for name, value in values.items()
+        }
+
+    def get_read_state(self):
+        """The Conversation columns to SET for a new message: the sender
+        has read up to it, the other participant has one more unread."""
+        return {
+            f"{role}_{name}": models.Case(
+                models.When(**{role: self.sender_id}, then=sent),
+                default=received,
+                output_field=Conversation._meta.get_field(f"{role}_{name}"),
+            )
+            for role in PARTICIPANTS
+            for name, sent, received in (
+                ("last_read_id", models.Value(self.pk),
+                 models.F(f"{role}_last_read_id")),
+                ("unread", models.Value(0), models.F(f"{role}_unread") + 1),
+            )
+        }
+
     def save(self, *args, **kwargs):
-        update_conversation = False
-        if self.pk is None:
-            update_conversation = True
-        else:
-            old_message = Message.objects.get(pk=self.pk)
-            if old_message.sent_at != self.sent_at:
-                update_conversation = True
+        adding = self._state.adding
+        update_conversation = (
+            self._state.adding
+            or self.sent_at != getattr(self, "_loaded_sent_at", None)
+        )
+        update_preview = self.content != getattr(self, "_loaded_content", None)
+        with transaction.atomic(using=kwargs.get("using"), savepoint=False):
+            super().save(*args, **kwargs)
+            conversation = Conversation.objects.filter(pk=self.conversation_id)
+            if update_conversation:
+                # A targeted UPDATE: no need to load the conversation, and
+                # its row is only locked for as long as this transaction.
+                conversation.update(
+                    updated_at=timezone.now(),
+                    **self.get_snapshot(),
+                    **(self.get_read_state() if adding else {}),
+                )
+            elif update_preview:
+                conversation.filter(last_message=self.pk).update(
+                    last_message_preview=self.preview)
+        self._loaded_sent_at = self.sent_at
+        self._loaded_content = self.content
 
-        super().save(*args, **kwargs)
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        with transaction.atomic(using=kwargs.get("using"), savepoint=False):
+            deleted = super().delete(*args, **kwargs)
+            # Take the message back from the unread count of the participant
+            # who had not read it yet.
+            Conversation.objects.filter(pk=self.conversation_id).update(**{
+                f"{role}_unread": models.Case(
+                    models.When(
+                        ~models.Q(**{role: self.sender_id})
+                        & models.Q(**{f"{role}_unread__gt": 0})
+                        & (models.Q(**{f"{role}_last_read_id__isnull": True})
+                           | models.Q(**{f"{role}_last_read_id__lt": pk})),
+                        then=models.F(f"{role}_unread") - 1,
+                    ),
+                    default=models.F(f"{role}_unread"),
+                    output_field=Conversation._meta.get_field(f"{role}_unread"),
+                )
+                for role in PARTICIPANTS
+            })
+            # Deleting the latest message nulled last_message.
+            Conversation.objects.filter(
+                pk=self.conversation_id, last_message__isnull=True
+            ).refresh_last_message()
+        return deleted
 
-        if update_conversation:
-            conversation = self.conversation
-            conversation.updated_at = timezone.now()
-            conversation.save()
+
+class Job(models.Model):
+    """A unit of background work, run by the run_jobs command.
+
+    A worker claims a job by pushing available_at past its visibility
+    timeout: if the worker dies, the job becomes available again once the
+    timeout expires.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at", "id"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="apis_job_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class StoredFile(models.Model):
+    """A media file known to exist in storage, recorded when its upload
+    completes so that existence checks do not hit the storage backend."""
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64, db_index=True)
+    # Photo and User rows referencing the file, see apis.storage.
+    ref_count = models.PositiveIntegerField(default=0)
+    # Formats whose encoding of the file wasn't smaller, see apis.encodings.
+    rejected_encodings = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+
+class NamespaceVersion(models.Model):
+    """Version of the rows rendered under a response cache namespace.
+
+    Bumped after every write the namespace is invalidated by commits, so
+    that conditional list requests served by any process see it.
+    """
+
+    namespace = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def bump(cls, namespaces):
+        namespaces = sorted(set(namespaces))
+        now = timezone.now()
+        bumped = cls.objects.filter(namespace__in=namespaces).update(
+            version=models.F("version") + 1, updated_at=now)
+        if bumped < len(namespaces):
+            cls.objects.bulk_create(
+                [cls(namespace=namespace, version=1, updated_at=now)
+                 for namespace in namespaces],
+                ignore_conflicts=True,
+            )
+
+    def __str__(self):
+        return f"{self.namespace} v{self.version}"
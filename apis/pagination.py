@@ -0,0 +1,137 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Limit/offset pagination by default, keyset pagination on request.
+
+    Views opt in by declaring a ``cursor_ordering`` such as
+    ``("-created_at", "-id")`` whose last field is unique. Clients then send
+    ``?cursor=`` (empty for the first page) and follow the ``next`` link.
+    Pages are fetched with an indexed range condition on the ordering and
+    no ``COUNT(*)``, so every page costs the same as the first one.
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, "cursor_ordering", None)
+        self.use_cursor = self.ordering is not None and self.wants_cursor(request)
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position))
+
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.next_position = self.get_position(page[-1]) if self.has_next else None
+        return page
+
+    def wants_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"].pop("count")
+        response_schema["properties"].pop("previous")
+        return response_schema
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_keyset_filter(self, position):
+        # (a, b) < (x, y) is spelled a <= x AND (a < x OR (a = x AND b < y))
+        # so the leading bound can be used as an index range condition.
+        fields = [field.lstrip("-") for field in self.ordering]
+        lookups = ["lt" if field.startswith("-") else "gt" for field in self.ordering]
+        after = Q()
+        for index, field in enumerate(fields):
+            equal = dict(zip(fields[:index], position[:index]))
+            equal[f"{field}__{lookups[index]}"] = position[index]
+            after |= Q(**equal)
+        leading_bound = {f"{fields[0]}__{lookups[0]}e": position[0]}
+        return Q(**leading_bound) & after
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip("-"))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def encode_cursor(self, position):
+        data = json.dumps(position, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(data).decode("ascii")
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # Cursors come from the client: check each value against its field
+        # before it reaches the query.
+        values = []
+        for field_name, value in zip(self.ordering, position):
+            field = model._meta.get_field(field_name.lstrip("-"))
+            try:
+                value = field.to_python(value)
+                if value is None:
+                    raise ValueError
+                field.run_validators(value)
+                # Not every backend bounds integer fields' validators.
+                if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                    raise ValueError
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return values
+
+
+class HistoryPagination(KeysetPagination):
+    """Keyset pagination only, for histories that are read from the newest
+    end and would only get slower with an offset."""
+
+    default_limit = 50
+    max_limit = 200
+
+    def wants_cursor(self, request):
+        return True
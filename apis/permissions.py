@@ -1,7 +1,8 @@
 from rest_framework import permissions
 
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from .models import User, Message, Garden
+from .models import Conversation, Garden, Message
 
 
 class IsGardenOwnerPermission(permissions.BasePermission):
@@ -27,20 +28,22 @@ class IsCommentOwnerPermission(permissions.BasePermission):
 
 
 class IsConversationMembersPermission(permissions.BasePermission):
-    def has_permission(self, request, view):
-        current_user_id = request.query_params.get('current_user_id', None)
-
-        if current_user_id:
-            try:
-                User.objects.get(id=current_user_id)
-            except User.DoesNotExist:
-                return False
+    """Only the two participants may access a conversation.
 
-        if request.method != "POST":
-            queryset = view.get_queryset()
-            return any(conversation.chat_sender_id == request.user.id or conversation.chat_receiver_id == request.user.id for conversation in queryset)
+    Lists need no check, the view only lists the user's conversations; a
+    single conversation is checked with one EXISTS on its primary key.
+    """
 
-        return True
+    def has_permission(self, request, view):
+        lookup = view.lookup_url_kwarg or view.lookup_field
+        pk = view.kwargs.get(lookup)
+        if pk is None:
+            return True
+        try:
+            conversation = Conversation.objects.filter(pk=pk)
+        except (ValueError, TypeError):
+            raise Http404
+        return conversation.for_participant(request.user).exists()
 
 
 class IsConversationParticipant(permissions.BasePermission):
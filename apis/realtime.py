@@ -0,0 +1,286 @@
+"""Push new messages to connected clients over server-sent events.
+
+core.asgi routes GET /api/events to stream(). Each open stream subscribes
+to the process-wide broker under its user id, and every committed message
+is published to both participants of its conversation.
+
+The broker only reaches streams held by the current process. The backend
+named by the REALTIME_BACKEND setting carries events between processes:
+LocalBackend hands them straight back to this process's broker, which is
+enough for a single server and for tests; PostgresBackend sends them
+through LISTEN/NOTIFY so every server process receives them.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from corsheaders.conf import conf as cors_conf
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_INTERVAL = 15
+QUEUE_SIZE = 100
+NOTIFY_CHANNEL = "apis_events"
+# Postgres refuses NOTIFY payloads of 8000 bytes or more.
+NOTIFY_MAX_SIZE = 7900
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        # Runs on the subscriber's loop.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client can't keep up: end its stream, it will reconnect
+            # and catch up from the message history.
+            self.overflowed = True
+
+
+class Broker:
+    """In-process fan-out from user ids to their open streams."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.backend = None
+
+    def get_backend(self):
+        with self.lock:
+            if self.backend is None:
+                self.backend = import_string(settings.REALTIME_BACKEND)(self)
+            return self.backend
+
+    def subscribe(self, user_id):
+        self.get_backend().start()
+        subscription = Subscription(user_id)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def dispatch(self, user_ids, event):
+        """Deliver an event to this process's streams; thread-safe."""
+        with self.lock:
+            subscriptions = [
+                subscription
+                for user_id in user_ids
+                for subscription in self.subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+    def publish(self, user_ids, event):
+        self.get_backend().publish(list(user_ids), event)
+
+
+class LocalBackend:
+    """Delivers events within the publishing process only."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def start(self):
+        pass
+
+    def publish(self, user_ids, event):
+        self.broker.dispatch(user_ids, event)
+
+
+class PostgresBackend:
+    """Delivers events to every process through LISTEN/NOTIFY.
+
+    Each process listens on a dedicated connection from a daemon thread,
+    started with the first stream it serves.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.listen, name="realtime-listener", daemon=True)
+                self.thread.start()
+
+    def publish(self, user_ids, event):
+        payload = json.dumps({"users": user_ids, "event": event})
+        if len(payload.encode("utf-8")) > NOTIFY_MAX_SIZE:
+            # Too big to notify: send the ids and let clients fetch the rest.
+            event = dict(event, data={
+                key: event["data"][key] for key in ("id", "conversation_id")})
+            payload = json.dumps({"users": user_ids, "event": event})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [NOTIFY_CHANNEL, payload])
+
+    def listen(self):
+        while True:
+            try:
+                self.receive_notifications()
+            except Exception:
+                logger.exception("Lost the %s listener, reconnecting", NOTIFY_CHANNEL)
+                threading.Event().wait(KEEPALIVE_INTERVAL)
+
+    def receive_notifications(self):
+        listener = connection.copy()
+        try:
+            listener.ensure_connection()
+            listener.set_autocommit(True)
+            raw = listener.connection
+            with raw.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while True:
+                if select.select([raw], [], [], KEEPALIVE_INTERVAL)[0]:
+                    raw.poll()
+                    while raw.notifies:
+                        notification = json.loads(raw.notifies.pop(0).payload)
+                        self.broker.dispatch(
+                            notification["users"], notification["event"])
+        finally:
+            listener.close()
+
+
+broker = Broker()
+
+
+def publish_message(message):
+    """Send a message to both participants once its transaction commits."""
+    from .serializers import MessageSerializer
+
+    conversation = message.conversation
+    user_ids = {conversation.chat_sender_id, conversation.chat_receiver_id}
+    event = {"type": "message", "data": MessageSerializer(message).data}
+    transaction.on_commit(lambda: broker.publish(user_ids, event))
+
+
+def format_event(event):
+    data = json.dumps(event["data"], separators=(",", ":"), default=str)
+    return f"id: {event['data']['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+def get_header(scope, header):
+    for name, value in scope.get("headers", []):
+        if name == header:
+            return value.decode("latin-1")
+    return None
+
+
+def get_token(scope):
+    keyword, _, key = (get_header(scope, b"authorization") or "").partition(" ")
+    if keyword == "Token":
+        return key.strip()
+    # EventSource can't send headers, so browsers pass the token in the URL.
+    # It then shows up in access logs: see the README.
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("token", [None])[0]
+
+
+def get_cors_headers(scope):
+    """The headers CorsMiddleware would add, as the stream bypasses it."""
+    headers = [(b"vary", b"origin")]
+    origin = get_header(scope, b"origin")
+    if origin and (cors_conf.CORS_ALLOW_ALL_ORIGINS
+                   or origin in cors_conf.CORS_ALLOWED_ORIGINS):
+        headers.append((b"access-control-allow-origin", origin.encode("latin-1")))
+        if cors_conf.CORS_ALLOW_CREDENTIALS:
+            headers.append((b"access-control-allow-credentials", b"true"))
+    return headers
+
+
+@sync_to_async
+def authenticate(scope):
+    from rest_framework.authtoken.models import Token
+
+    key = get_token(scope)
+    if not key:
+        return None
+    # Streams don't go through Django's request handling, which closes
+    # connections that are broken or past CONN_MAX_AGE around each request.
+    close_old_connections()
+    try:
+        return (
+            Token.objects.filter(key=key, user__is_active=True)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+    finally:
+        close_old_connections()
+
+
+async def stream(scope, receive, send):
+    """ASGI application streaming the requesting user's events."""
+    cors_headers = get_cors_headers(scope)
+    user_id = await authenticate(scope)
+    if user_id is None:
+        await send({
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [(b"content-type", b"application/json"), *cors_headers],
+        })
+        await send({
+            "type": "http.response.body",
+            "body": b'{"detail":"Authentication credentials were not provided."}',
+        })
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            # Stop nginx from buffering the stream.
+            (b"x-accel-buffering", b"no"),
+            *cors_headers,
+        ],
+    })
+    subscription = broker.subscribe(user_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({"type": "http.response.body", "body": b": connected\n\n",
+                    "more_body": True})
+        while not subscription.overflowed:
+            event = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {event, disconnected}, timeout=KEEPALIVE_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                event.cancel()
+                return
+            if event in done:
+                body = format_event(event.result())
+            else:
+                event.cancel()
+                body = ": keepalive\n\n"
+            await send({"type": "http.response.body",
+                        "body": body.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(subscription)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
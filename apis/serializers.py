@@ -1,58 +1,126 @@
-import os
-
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 
 from accounts.models import User
 
-from .models import Comment, Conversation, Garden, Message, Photo
+from .fields import BoundedImageField
+from .models import (Comment, Conversation, Garden, Message, Photo,
+                     StoredFile, UploadSession)
+from .pagination import HistoryPagination
+from .variants import variant_urls
 
 
 class UserSerializer(serializers.ModelSerializer):
+    profile_image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ("id", "experience", "profile_image", "nickname")
+        fields = ("id", "experience", "profile_image",
+                  "profile_image_variants", "profile_image_status", "nickname")
+
+    def get_profile_image_variants(self, obj):
+        return variant_urls(self.context.get("request"), obj.profile_image,
+                            obj.profile_image_variants)
 
 
 class PhotoSerializer(serializers.ModelSerializer):
+    image = BoundedImageField(required=False)
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Photo
-        fields = ("id", "garden_id", "image", "is_main_photo", "season")
+        fields = ("id", "garden_id", "image", "variants",
+                  "processing_status", "is_main_photo", "season")
+
+    def get_variants(self, obj):
+        return variant_urls(self.context.get("request"), obj.image,
+                            obj.variants)
+
+
+class PhotoBatchSerializer(serializers.Serializer):
+    garden_id = serializers.IntegerField()
+    season = serializers.IntegerField(default=0)
+    main_photo_index = serializers.IntegerField(required=False, min_value=0)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    garden_id = serializers.IntegerField()
+
+    class Meta:
+        model = UploadSession
+        fields = ("id", "garden_id", "filename", "size", "offset",
+                  "is_main_photo", "season", "photo_id")
+        read_only_fields = ("id", "offset", "photo_id")
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Must be between 1 and {settings.IMAGE_UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+
+class GardenListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Look the main photos of the page up in the media index at once,
+        # rather than for every garden, or for every row counted.
+        gardens = list(data.all() if hasattr(data, "all") else data)
+        names = {garden.main_photo.image.name for garden in gardens
+                 if garden.main_photo and garden.main_photo.image}
+        stored = set(StoredFile.objects.filter(name__in=names).values_list(
+            "name", flat=True)) if names else set()
+        for garden in gardens:
+            if garden.main_photo and garden.main_photo.image:
+                garden.main_photo_stored = garden.main_photo.image.name in stored
+        return super().to_representation(gardens)
 
 
 class GardenSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     user_id = serializers.IntegerField()
     user = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
 
     class Meta:
         model = Garden
         fields = ("id", "user_id", "user", "title", "description",
-                  "zipcode", "image", "address")
+                  "zipcode", "image", "image_variants", "address",
+                  "distance_km")
         read_only_fields = ("image",)
         write_only_fields = ("address",)
+        list_serializer_class = GardenListSerializer
         extra_kwargs = {
             "address": {"write_only": True, "required": False},
         }
 
-    def get_image(self, obj):
-        try:
-            image = Photo.objects.filter(garden_id=obj).first()
-            if image and image.image:
-                image_url = image.image.url
-                image_path = image.image.path
-                request = self.context.get("request")
-                if request and os.path.exists(image_path):
-                    host_url = request.build_absolute_uri("/")
-                    return f"{host_url}{image_url}"
-                return None
-            else:
-                return None
-        except ObjectDoesNotExist:
+    def get_stored_main_photo(self, obj):
+        photo = obj.main_photo
+        if not photo or not photo.image:
             return None
+        if not hasattr(obj, "main_photo_stored"):
+            obj.main_photo_stored = StoredFile.objects.filter(
+                name=photo.image.name).exists()
+        return photo if obj.main_photo_stored else None
+
+    def get_image(self, obj):
+        photo = self.get_stored_main_photo(obj)
+        request = self.context.get("request")
+        if request and photo:
+            return request.build_absolute_uri(photo.image.url)
+        return None
+
+    def get_image_variants(self, obj):
+        photo = self.get_stored_main_photo(obj)
+        if not photo:
+            return {}
+        return variant_urls(self.context.get("request"), photo.image,
+                            photo.variants)
+
+    def get_distance_km(self, obj):
+        distance_km = getattr(obj, "distance_km", None)
+        return round(distance_km, 1) if distance_km is not None else None
 
     def create(self, validated_data):
         user_id = validated_data.pop("user_id", None)
@@ -62,13 +130,9 @@ class GardenSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def get_user(self, obj):
-        try:
-            user = get_object_or_404(User, pk=obj.user_id)
-            serializer = UserSerializer(
-                user, context={"request": self.context.get("request")})
-            return serializer.data
-        except ObjectDoesNotExist:
-            return {}
+        serializer = UserSerializer(
+            obj.user, context={"request": self.context.get("request")})
+        return serializer.data
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -106,13 +170,9 @@ class CommentSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def get_author(self, obj):
-        try:
-            author = get_object_or_404(User, pk=obj.author_id)
-            serializer = UserSerializer(
-                author, context={"request": self.context.get("request")})
-            return serializer.data
-        except ObjectDoesNotExist:
-            return {}
+        serializer = UserSerializer(
+            obj.author, context={"request": self.context.get("request")})
+        return serializer.data
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -123,7 +183,7 @@ class MessageSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data["sent_at"] = timezone.now()
-        writable_fields = ["sender_id", "conversation_id", "content"]
+        writable_fields = ["sender_id", "conversation", "content"]
         writable_validated_data = {
             key: validated_data[key] for key in validated_data if key in writable_fields
         }
@@ -132,7 +192,22 @@ class MessageSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ListConversationSerializer(serializers.ModelSerializer):
+class ReadStateMixin(serializers.Serializer):
+    """The requesting user's unread count, and how far each participant
+    has read (the id of the last message they read)."""
+
+    unread_count = serializers.SerializerMethodField()
+
+    def get_unread_count(self, obj):
+        request = self.context.get("request")
+        if request is None:
+            return None
+        if obj.chat_sender_id == request.user.id:
+            return obj.chat_sender_unread
+        return obj.chat_receiver_unread
+
+
+class ListConversationSerializer(ReadStateMixin, serializers.ModelSerializer):
     latest_message = serializers.SerializerMethodField()
     chat_sender_id = serializers.SerializerMethodField()
 
@@ -144,36 +219,42 @@ class ListConversationSerializer(serializers.ModelSerializer):
             "chat_receiver_id",
             "latest_message",
             "updated_at",
+            "unread_count",
+            "chat_sender_last_read_id",
+            "chat_receiver_last_read_id",
         )
 
     def get_chat_sender_id(self, obj):
         return obj.chat_sender_id
 
     def get_latest_message(self, obj):
-        try:
-            latest_message = Message.objects.filter(conversation_id=obj.id).latest(
-                "sent_at"
-            )
-            serializer = MessageSerializer(latest_message)
-            return serializer.data
-        except ObjectDoesNotExist:
+        if obj.last_message_id is None:
             return {}
+        return {
+            "id": obj.last_message_id,
+            "conversation_id": obj.id,
+            "content": obj.last_message_preview,
+            "sender_id": obj.last_message_sender_id,
+            "sent_at": serializers.DateTimeField().to_representation(
+                obj.last_message_at),
+        }
 
 
-class ConversationShowSerializer(serializers.ModelSerializer):
+class ConversationShowSerializer(ReadStateMixin, serializers.ModelSerializer):
     messages = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
-        fields = ("id", "chat_sender_id", "chat_receiver_id", "messages")
+        fields = ("id", "chat_sender_id", "chat_receiver_id", "messages",
+                  "unread_count", "chat_sender_last_read_id",
+                  "chat_receiver_last_read_id")
 
     def get_messages(self, obj):
-        messages = Message.objects.filter(conversation_id=obj.id)
-        if messages.exists():
-            serializer = MessageSerializer(messages, many=True)
-            return serializer.data
-        else:
-            return []
+        # Only the newest page: older messages are paged through
+        # /api/conversations/{id}/messages.
+        messages = Message.objects.filter(conversation_id=obj.id).order_by(
+            "-sent_at", "-id")[:HistoryPagination.default_limit]
+        return MessageSerializer(messages, many=True).data
 
 
 class ConversationPostSerializer(serializers.ModelSerializer):
@@ -0,0 +1,80 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from accounts.models import User
+
+from . import cache, realtime, storage, variants
+from .models import Comment, Garden, Message, Photo, StoredFile
+
+
+@receiver([post_save, post_delete], sender=Garden)
+def invalidate_gardens(sender, **kwargs):
+    cache.invalidate("gardens", "users")
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_comments(sender, **kwargs):
+    cache.invalidate("comments", "users")
+
+
+@receiver(post_save, sender=Message)
+def push_message(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        realtime.publish_message(instance)
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_save, sender=User)
+def queue_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        variants.queue_variants(instance)
+
+
+@receiver([post_save, post_delete], sender=Photo)
+def invalidate_photos(sender, **kwargs):
+    cache.invalidate("gardens", "photos", "users")
+
+
+@receiver([post_save, post_delete], sender=StoredFile)
+def invalidate_garden_images(sender, **kwargs):
+    # Garden images are only rendered once their file is indexed.
+    cache.invalidate("gardens", "users")
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_garden_owners(sender, update_fields=None, **kwargs):
+    # Gardens and comments embed their users' public profile; logins only
+    # touch last_login.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    cache.invalidate("gardens", "users", "comments")
+
+
+@receiver(pre_save, sender=Photo)
+@receiver(pre_save, sender=User)
+def remember_stored_file(sender, instance, update_fields=None, **kwargs):
+    field = dict(storage.REFERENCING_FIELDS)[sender]
+    if update_fields is not None and field not in update_fields:
+        return
+    instance._previous_file_name = (
+        sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+        if instance.pk is not None else None
+    )
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_save, sender=User)
+def count_stored_file_references(sender, instance, raw=False, **kwargs):
+    if raw or not hasattr(instance, "_previous_file_name"):
+        return
+    previous_name = instance.__dict__.pop("_previous_file_name")
+    name = getattr(instance, dict(storage.REFERENCING_FIELDS)[sender]).name
+    if name != previous_name:
+        storage.acquire(name)
+        storage.release(previous_name)
+
+
+@receiver(post_delete, sender=Photo)
+@receiver(post_delete, sender=User)
+def release_stored_file(sender, instance, **kwargs):
+    storage.release(getattr(instance, dict(storage.REFERENCING_FIELDS)[sender]).name)
@@ -0,0 +1,137 @@
+import hashlib
+import posixpath
+import re
+from functools import lru_cache
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import User
+
+from .models import Photo, StoredFile
+
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(\.\w+)?$")
+
+
+def file_checksum(content):
+    checksum = hashlib.sha256()
+    for chunk in content.chunks():
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def upload_directories():
+    directories = set()
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField) and isinstance(field.upload_to, str):
+                directories.add(field.upload_to.strip("/"))
+    return sorted(directories)
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED_NAME.match(posixpath.basename(name or "")))
+
+
+def is_upload(name):
+    """Whether name is a content-addressed file of an upload directory,
+    rather than a file derived from one, such as a variant or an encoding,
+    or a file saved before content addressing."""
+    return (posixpath.dirname(name or "") in upload_directories()
+            and is_content_addressed(name))
+
+
+class IndexedFileSystemStorage(FileSystemStorage):
+    """FileSystemStorage that keeps the StoredFile index up to date."""
+
+    def _save(self, name, content):
+        checksum = file_checksum(content)
+        name = super()._save(name, content)
+        StoredFile.objects.update_or_create(
+            name=name, defaults={
+                "size": content.size, "checksum": checksum, "rejected_encodings": []}
+        )
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        StoredFile.objects.filter(name=name).delete()
+
+
+class ContentAddressedStorage(IndexedFileSystemStorage):
+    """Store uploads once per content, named after their checksum.
+
+    Files saved directly in an upload directory are renamed after their
+    sha256, and a file whose checksum is already indexed isn't written
+    again: its existing name is returned instead. Other files, such as
+    image variants, are stored under the name they are given.
+
+    The Photo and User rows referencing each file are counted in
+    StoredFile.ref_count; collect_media deletes the files no longer
+    referenced.
+    """
+
+    def _save(self, name, content):
+        directory, filename = posixpath.split(name)
+        if directory not in upload_directories():
+            return super()._save(name, content)
+
+        checksum = file_checksum(content)
+        # Touching updated_at keeps collect_media from deleting the file
+        # before the row that will reference it is saved. If collect_media
+        # deleted the row first, the file is gone too: write it again.
+        # Variants and encodings are left out: they go away with their source.
+        stored_file = next((
+            candidate for candidate in StoredFile.objects.filter(checksum=checksum)
+            if is_upload(candidate.name)
+        ), None)
+        if stored_file is not None and self.exists(stored_file.name):
+            touched = StoredFile.objects.filter(pk=stored_file.pk).update(
+                updated_at=timezone.now())
+            if touched:
+                return stored_file.name
+
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, checksum + extension)
+        if self.exists(name):
+            # Indexed under another checksum, or not indexed: overwrite it.
+            super(IndexedFileSystemStorage, self).delete(name)
+        return super()._save(name, content)
+
+
+# The file fields whose rows are counted in StoredFile.ref_count.
+REFERENCING_FIELDS = ((Photo, "image"), (User, "profile_image"))
+
+
+def acquire(name, count=1):
+    """Count new references to a stored file."""
+    if name:
+        StoredFile.objects.filter(name=name).update(
+            ref_count=F("ref_count") + count, updated_at=timezone.now())
+
+
+def release(name):
+    """Drop a reference to a stored file, see collect_media."""
+    if name:
+        StoredFile.objects.filter(name=name, ref_count__gt=0).update(
+            ref_count=F("ref_count") - 1, updated_at=timezone.now())
+
+
+def count_references():
+    """Recompute every StoredFile.ref_count from the rows referencing it."""
+    references = [
+        Coalesce(Subquery(
+            model.objects.filter(**{field: OuterRef("name")})
+            .order_by()
+            .values(field)
+            .annotate(count=models.Count("pk"))
+            .values("count")
+        ), 0)
+        for model, field in REFERENCING_FIELDS
+    ]
+    return StoredFile.objects.update(ref_count=sum(references, Value(0)))
@@ -1,13 +1,40 @@
+import base64
+import io
+import itertools
 import json
-
+import os
+import random
+import shutil
+import tempfile
+
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from rest_framework.test import APITestCase
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from accounts.factory import UserFactory
+from accounts.testing import TemporaryMediaMixin, data_queries
 from accounts.utils import temporary_image
+from apis import cache as response_cache
+from apis import encodings, fields, geo, jobs, storage, variants
 from apis.factory import GardenFactory, TestHelper
+from core.asgi import application
 
-from .models import Comment, Conversation, Garden, Message, Photo, User
+from .models import (Comment, Conversation, Garden, Job, Message,
+                     NamespaceVersion, Photo, StoredFile, UploadSession, User)
 
 
 class TestCreateGarden(APITestCase):
@@ -128,6 +155,305 @@ class TestListGardens(APITestCase):
         assert "93100" not in zipcode_list
 
 
+class TestGardenProximitySearch(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "hello@world", "hello_world_123"
+        )
+        self.garden_11 = Garden.objects.create(
+            user_id=self.user.id, title="bastille", zipcode="75011")
+        self.garden_20 = Garden.objects.create(
+            user_id=self.user.id, title="menilmontant", zipcode="75020")
+        self.garden_16 = Garden.objects.create(
+            user_id=self.user.id, title="auteuil", zipcode="75016")
+        self.garden_unknown = Garden.objects.create(
+            user_id=self.user.id, title="ailleurs", zipcode="00000")
+
+    def test_should_store_coordinates_on_write(self):
+        assert self.garden_11.latitude is not None
+        assert self.garden_11.geo_cell is not None
+        assert self.garden_unknown.latitude is None
+
+        self.garden_unknown.zipcode = "75011"
+        self.garden_unknown.save(update_fields=["zipcode"])
+        self.garden_unknown.refresh_from_db()
+        assert self.garden_unknown.geo_cell == self.garden_11.geo_cell
+
+    def test_should_list_gardens_within_radius_sorted_by_distance(self):
+        response = self.client.get("/api/gardens?near=75011&radius_km=5")
+        json_response = json.loads(response.content)
+        assert response.status_code == 200
+        assert [res["id"] for res in json_response["results"]] == [
+            self.garden_11.id, self.garden_20.id]
+        distances = [res["distance_km"] for res in json_response["results"]]
+        assert distances[0] == 0
+        assert 0 < distances[1] <= 5
+
+    def test_should_widen_results_with_radius(self):
+        response = self.client.get("/api/gardens?near=75011&radius_km=15")
+        json_response = json.loads(response.content)
+        assert json_response["count"] == 3
+
+    def test_should_reject_unknown_zipcode_and_invalid_radius(self):
+        response = self.client.get("/api/gardens?near=00000")
+        assert response.status_code == 400
+        response = self.client.get("/api/gardens?near=75011&radius_km=500")
+        assert response.status_code == 400
+
+    def test_building_the_zipcode_table_should_relocate_existing_gardens(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(geo.zipcode_centroids.cache_clear)
+        source = os.path.join(directory, "communes.csv")
+        with open(source, "w") as source_file:
+            source_file.write(
+                "code_postal,latitude,longitude\n"
+                "75011,48.8590,2.3800\n"
+                "00000,43.2965,5.3698\n"
+            )
+
+        with mock.patch.object(
+                geo, "ZIPCODES_PATH", Path(directory) / "zipcodes.csv"):
+            call_command("build_zipcode_table", source, stdout=io.StringIO())
+
+        for garden in (self.garden_11, self.garden_20, self.garden_unknown):
+            garden.refresh_from_db()
+        assert self.garden_11.latitude == 48.859
+        assert self.garden_unknown.latitude == 43.2965
+        assert self.garden_unknown.geo_cell == geo.grid_cell(43.2965, 5.3698)
+        assert self.garden_20.latitude is None
+        assert self.garden_20.geo_cell is None
+
+    def test_should_resolve_zipcodes_outside_paris_from_the_official_dataset(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(geo.zipcode_centroids.cache_clear)
+        # Columns of the official dataset, downloaded when no source is given.
+        official = io.BytesIO(
+            "code_commune_INSEE,nom_commune_postal,code_postal,latitude,longitude\n"
+            "69381,LYON 01,69001,45.7676,4.8345\n"
+            "69123,LYON,69001,45.7580,4.8351\n"
+            "33063,BORDEAUX,33000,44.8378,-0.5792\n".encode("utf-8-sig"))
+
+        with mock.patch.object(
+                geo, "ZIPCODES_PATH", Path(directory) / "zipcodes.csv"), \
+                mock.patch("urllib.request.urlopen", return_value=official):
+            call_command("build_zipcode_table", stdout=io.StringIO())
+            lyon = Garden.objects.create(
+                user_id=self.user.id, title="croix-rousse", zipcode="69001")
+            response = self.client.get("/api/gardens?near=69001&radius_km=5")
+
+        assert response.status_code == 200
+        assert [res["id"] for res in json.loads(response.content)["results"]] == [
+            lyon.id]
+        assert lyon.latitude == 45.7628
+        assert geo.locate_zipcode("33000") == (44.8378, -0.5792)
+
+
+class TestGardenSearch(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "hello@world", "hello_world_123"
+        )
+        # The better match is created first, so that the newest-first
+        # tie-break alone would list it last.
+        self.tomates = Garden.objects.create(
+            user_id=self.user.id, title="Tomates anciennes",
+            description="Un petit jardin", zipcode="75020")
+        self.potager = Garden.objects.create(
+            user_id=self.user.id, title="Le potager de Lucie",
+            description="Des tomates et des courgettes", zipcode="75011")
+        self.roses = Garden.objects.create(
+            user_id=self.user.id, title="La roseraie",
+            description="Des roses", zipcode="75016")
+
+    def search(self, text):
+        response = self.client.get("/api/gardens", {"q": text})
+        assert response.status_code == 200
+        return [res["id"] for res in json.loads(response.content)["results"]]
+
+    @skipUnless(connection.vendor == "postgresql", "Ranking needs Postgres")
+    def test_should_rank_title_matches_before_description_matches(self):
+        assert self.search("tomate") == [self.tomates.id, self.potager.id]
+
+    def test_should_keep_search_index_up_to_date_on_write(self):
+        assert self.search("framboises") == []
+        self.roses.description = "Des roses et des framboises"
+        self.roses.save()
+        assert self.search("framboises") == [self.roses.id]
+
+    def test_should_combine_search_with_other_filters(self):
+        assert self.search("potager") == [self.potager.id]
+        response = self.client.get(
+            "/api/gardens", {"q": "tomates", "zipcode": "75020"})
+        results = json.loads(response.content)["results"]
+        assert [res["id"] for res in results] == [self.tomates.id]
+
+
+class TestAnonymousResponseCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            "hello@world", "hello_world_123"
+        )
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+
+    def test_should_serve_repeated_anonymous_reads_from_cache(self):
+        first = self.client.get("/api/gardens?limit=5")
+        with CaptureQueriesContext(connection) as context:
+            second = self.client.get("/api/gardens?limit=5")
+        assert first["X-Cache"] == "MISS"
+        assert second["X-Cache"] == "HIT"
+        assert len(data_queries(context)) == 0
+        assert json.loads(first.content) == json.loads(second.content)
+        assert self.client.get("/api/gardens?limit=6")["X-Cache"] == "MISS"
+        assert response_cache.get_stats("gardens") == {"hits": 1, "misses": 2}
+
+    def test_should_answer_conditional_requests_from_cache(self):
+        etag = self.client.get("/api/gardens")["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/gardens", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response["X-Cache"] == "HIT"
+        assert len(data_queries(context)) == 0
+
+    def test_should_invalidate_cached_pages_on_write(self):
+        self.client.get(f"/api/gardens/{self.garden.id}")
+        self.client.force_authenticate(user=self.user)
+        self.client.patch(
+            f"/api/gardens/{self.garden.id}", {"title": "tata"}, format="json")
+        self.client.force_authenticate(user=None)
+
+        response = self.client.get(f"/api/gardens/{self.garden.id}")
+        assert response["X-Cache"] == "MISS"
+        assert json.loads(response.content)["title"] == "tata"
+
+    def test_should_invalidate_garden_pages_when_a_photo_changes(self):
+        self.client.get("/api/gardens")
+        self.client.get("/api/photos")
+        Photo.objects.create(garden=self.garden, is_main_photo=True)
+        assert self.client.get("/api/gardens")["X-Cache"] == "MISS"
+        assert self.client.get("/api/photos")["X-Cache"] == "MISS"
+
+    def test_should_not_cache_authenticated_reads(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get("/api/gardens")
+        assert "X-Cache" not in response
+
+
+class TestGardenConditionalGet(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # Versions are bumped on commit, which the test case never reaches.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user(
+                "hello@world", "hello_world_123"
+            )
+            self.garden = Garden.objects.create(
+                user_id=self.user.id, title="toto", zipcode="75001"
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_should_maintain_updated_at_on_write(self):
+        updated_at = self.garden.updated_at
+        self.garden.title = "tata"
+        self.garden.save(update_fields=["title"])
+        self.garden.refresh_from_db()
+        assert self.garden.updated_at > updated_at
+
+    def test_should_return_304_for_a_fresh_detail_etag(self):
+        response = self.client.get(f"/api/gardens/{self.garden.id}")
+        etag = response["ETag"]
+        assert response["Last-Modified"]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                f"/api/gardens/{self.garden.id}", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response.content == b""
+        assert len(context.captured_queries) == 1
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f"/api/gardens/{self.garden.id}", {"title": "tata"}, format="json")
+        response = self.client.get(
+            f"/api/gardens/{self.garden.id}", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    def test_should_return_304_for_a_list_not_modified_since(self):
+        response = self.client.get("/api/gardens")
+        last_modified = response["Last-Modified"]
+        response = self.client.get(
+            "/api/gardens", HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == 304
+
+    def test_list_etag_should_change_when_the_owner_profile_changes(self):
+        etag = self.client.get("/api/gardens")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.nickname = "toto"
+            self.user.save()
+        response = self.client.get("/api/gardens", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_list_etag_should_change_when_a_garden_is_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other_garden = Garden.objects.create(
+                user_id=self.user.id, title="tata", zipcode="75001"
+            )
+        etag = self.client.get("/api/gardens")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            other_garden.delete()
+        response = self.client.get("/api/gardens", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_list_validators_should_not_query_the_whole_table(self):
+        etag = self.client.get("/api/gardens")["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/gardens", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        [query] = data_queries(context)
+        assert '"apis_namespaceversion"' in query["sql"]
+
+    def test_list_etag_should_change_on_writes_from_another_process(self):
+        etag = self.client.get("/api/gardens")["ETag"]
+        # A process that doesn't share the response cache, such as a
+        # worker misconfigured with its own.
+        with override_settings(CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            with self.captureOnCommitCallbacks(execute=True):
+                Garden.objects.filter(pk=self.garden.pk).update(title="tata")
+                response_cache.invalidate("gardens")
+        response = self.client.get("/api/gardens", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_comment_list_etag_should_change_when_a_comment_is_added(self):
+        etag = self.client.get("/api/comments")["ETag"]
+        response = self.client.get("/api/comments", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                author_id=self.user.id, receiver_id=self.user.id, content="FooBar")
+        response = self.client.get("/api/comments", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_list_versions_should_be_bumped_outside_the_write_transaction(self):
+        version = NamespaceVersion.objects.get(namespace="gardens").version
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                self.garden.title = "tata"
+                self.garden.save()
+                assert NamespaceVersion.objects.get(
+                    namespace="gardens").version == version
+        assert NamespaceVersion.objects.get(namespace="gardens").version == version
+
+        for callback in callbacks:
+            callback()
+        assert NamespaceVersion.objects.get(namespace="gardens").version > version
+
+
 class TestUdateGarden(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -178,6 +504,101 @@ class TestGardenPaginations(APITestCase):
         assert json_response["next"] is not None
 
 
+class TestGardenCursorPagination(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "hello@world", "hello_world_123"
+        )
+        created_at = timezone.now()
+        # Same timestamp for every garden: the id breaks the tie.
+        self.garden_ids = [
+            Garden.objects.create(user_id=self.user.id, created_at=created_at).id
+            for i in range(12)
+        ]
+
+    def test_should_walk_all_gardens_newest_first_without_counting(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/gardens?cursor=")
+        json_response = json.loads(response.content)
+        assert response.status_code == 200
+        assert "count" not in json_response
+        assert len(json_response["results"]) == 10
+        assert not any("COUNT(" in query["sql"]
+                       for query in data_queries(context))
+
+        Garden.objects.create(user_id=self.user.id)
+        response = self.client.get(json_response["next"])
+        second_page = json.loads(response.content)
+        assert len(second_page["results"]) == 2
+        assert second_page["next"] is None
+
+        ids = [res["id"] for res in json_response["results"] + second_page["results"]]
+        assert ids == sorted(self.garden_ids, reverse=True)
+
+    def test_should_keep_limit_offset_pagination_by_default(self):
+        response = self.client.get("/api/gardens")
+        json_response = json.loads(response.content)
+        assert json_response["count"] == 12
+
+    def test_should_return_404_for_an_invalid_cursor(self):
+        response = self.client.get("/api/gardens?cursor=nope")
+        assert response.status_code == 404
+
+    def test_should_return_404_for_a_tampered_cursor(self):
+        for position in (["yesterday", 1], [timezone.now().isoformat(), "one"],
+                         [timezone.now().isoformat(), 10 ** 30],
+                         [None, 1], [{}, []]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            response = self.client.get(f"/api/gardens?cursor={cursor}")
+            assert response.status_code == 404, position
+
+
+class TestGardenListQueryCount(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        StoredFile.objects.create(
+            name="apis/images/default.jpg", size=0, checksum="")
+        for i in range(12):
+            user = UserFactory.create_user()
+            garden = GardenFactory.create_garden(user_id=str(user.id))
+            Photo.objects.create(
+                garden=garden, image="apis/images/default.jpg", is_main_photo=False)
+            garden.refresh_main_photo()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        assert response.status_code == 200
+        return len(context.captured_queries)
+
+    def test_query_count_should_not_grow_with_page_size(self):
+        small_page = self.count_queries("/api/gardens?limit=2")
+        large_page = self.count_queries("/api/gardens?limit=12")
+        assert small_page == large_page
+
+    def test_should_only_check_the_stored_images_of_the_page(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get("/api/gardens?limit=2")
+        media_queries = [query["sql"] for query in context.captured_queries
+                         if '"apis_storedfile"' in query["sql"]]
+        assert len(media_queries) == 1
+        assert "COUNT(" not in media_queries[0]
+
+    def test_should_list_gardens_with_their_image(self):
+        response = self.client.get("/api/gardens")
+        json_response = json.loads(response.content)
+        images = [res["image"] for res in json_response["results"]]
+        assert all(image.endswith("/apis/images/default.jpg") for image in images)
+
+    def test_user_detail_query_count_should_not_grow_with_gardens(self):
+        user = UserFactory.create_user()
+        GardenFactory.create_garden(user_id=str(user.id))
+        one_garden = self.count_queries(f"/api/users/{user.id}")
+        for i in range(5):
+            GardenFactory.create_garden(user_id=str(user.id))
+        many_gardens = self.count_queries(f"/api/users/{user.id}")
+        assert one_garden == many_gardens
+
+
 class TestLeavingComments(APITestCase):
     def test_should_allow_a_user_to_comment_on_another(self):
         user = UserFactory.create_user()
@@ -236,7 +657,7 @@ class TestFetchCommentsOfAGivenUser(APITestCase):
         assert json_response["results"] == []
 
 
-class TestUploadGardenPhotos(APITestCase):
+class TestUploadGardenPhotos(TemporaryMediaMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
         self.garden = Garden.objects.create(
@@ -285,7 +706,561 @@ class TestUploadGardenPhotos(APITestCase):
         assert response.status_code == 401
 
 
-class TestListPhotos(APITestCase):
+class TestImageUploadLimits(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, image):
+        data = {"garden_id": self.garden.id, "image": image}
+        return self.client.post("/api/photos", data=data)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=100)
+    def test_should_reject_files_over_the_size_limit(self):
+        response = self.upload(temporary_image())
+        assert response.status_code == 400
+        assert json.loads(response.content)["image"] == [
+            "Ensure this file is at most 100 bytes."]
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100 * 100 - 1)
+    def test_should_reject_images_over_the_pixel_limit_from_their_header(self):
+        response = self.upload(temporary_image())
+        assert response.status_code == 400
+        assert json.loads(response.content)["image"] == [
+            "Ensure this image has at most 9999 pixels."]
+
+    @override_settings(IMAGE_DECODE_MAX_PIXELS=100 * 100)
+    def test_large_images_should_be_checked_at_a_reduced_scale(self):
+        with self.assertLogs("apis.fields") as logs:
+            response = self.upload(temporary_image((800, 800)))
+        assert response.status_code == 201
+        # Decoded at 1/8th of its size, 100x100 pixels of 4 bytes.
+        assert "800x800 JPEG, 40000 bytes decoded" in logs.output[0]
+
+    def test_decoded_size_should_follow_the_image_mode(self):
+        assert fields.decoded_size(Image.new("L", (10, 10))) == 100
+        assert fields.decoded_size(Image.new("I;16", (10, 10))) == 200
+        assert fields.decoded_size(Image.new("RGB", (10, 10))) == 400
+
+    def test_should_reject_truncated_images(self):
+        content = temporary_image((300, 300)).read()
+        truncated = io.BytesIO(content[:len(content) // 2])
+        truncated.name = "truncated.jpg"
+        response = self.upload(truncated)
+        assert response.status_code == 400
+
+    def test_should_reject_unexpected_formats(self):
+        image = io.BytesIO()
+        Image.new("RGB", (10, 10)).save(image, "BMP")
+        image.seek(0)
+        image.name = "image.bmp"
+        response = self.upload(image)
+        assert response.status_code == 400
+
+
+class TestResumableUploads(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.content = temporary_image((300, 200)).read()
+
+    def start_upload(self, **data):
+        data = {"garden_id": self.garden.id, "filename": "photo.jpg",
+                "size": len(self.content), "is_main_photo": True, **data}
+        response = self.client.post("/api/uploads", data, format="json")
+        assert response.status_code == 201
+        return json.loads(response.content)["id"]
+
+    def send_chunk(self, upload_id, start, end):
+        return self.client.put(
+            f"/api/uploads/{upload_id}", self.content[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.content)}")
+
+    def test_chunks_should_be_assembled_into_a_photo(self):
+        upload_id = self.start_upload()
+        middle = len(self.content) // 2
+        response = self.send_chunk(upload_id, 0, middle)
+        assert json.loads(response.content)["offset"] == middle
+        self.send_chunk(upload_id, middle, len(self.content))
+
+        response = self.client.post(f"/api/uploads/{upload_id}/finalize")
+        assert response.status_code == 201
+        photo = Photo.objects.get(pk=json.loads(response.content)["id"])
+        assert photo.image.read() == self.content
+        assert photo.is_main_photo
+        assert StoredFile.objects.filter(name=photo.image.name).exists()
+        self.garden.refresh_from_db()
+        assert self.garden.main_photo_id == photo.id
+
+        session = UploadSession.objects.get(pk=upload_id)
+        assert not default_storage.exists(session.part_name)
+        response = self.client.post(f"/api/uploads/{upload_id}/finalize")
+        assert json.loads(response.content)["id"] == photo.id
+
+    def test_upload_should_resume_from_the_acknowledged_offset(self):
+        upload_id = self.start_upload()
+        self.send_chunk(upload_id, 0, 100)
+        response = self.send_chunk(upload_id, 200, len(self.content))
+        assert response.status_code == 409
+
+        response = self.client.get(f"/api/uploads/{upload_id}")
+        assert json.loads(response.content)["offset"] == 100
+        response = self.client.post(f"/api/uploads/{upload_id}/finalize")
+        assert response.status_code == 409
+
+        self.send_chunk(upload_id, 100, len(self.content))
+        response = self.client.post(f"/api/uploads/{upload_id}/finalize")
+        assert response.status_code == 201
+
+    def test_should_reject_invalid_sessions_and_chunks(self):
+        response = self.client.post("/api/uploads", {
+            "garden_id": self.garden.id, "filename": "photo.jpg",
+            "size": settings.IMAGE_UPLOAD_MAX_SIZE + 1}, format="json")
+        assert response.status_code == 400
+
+        upload_id = self.start_upload()
+        response = self.client.put(
+            f"/api/uploads/{upload_id}", self.content,
+            content_type="application/octet-stream")
+        assert response.status_code == 400
+
+        self.client.force_authenticate(user=UserFactory.create_user())
+        response = self.send_chunk(upload_id, 0, len(self.content))
+        assert response.status_code == 404
+        response = self.client.post("/api/uploads", {
+            "garden_id": self.garden.id, "filename": "photo.jpg",
+            "size": 10}, format="json")
+        assert response.status_code == 403
+
+    def test_should_not_create_photos_from_files_that_are_not_images(self):
+        self.content = b"not an image"
+        upload_id = self.start_upload()
+        self.send_chunk(upload_id, 0, len(self.content))
+        response = self.client.post(f"/api/uploads/{upload_id}/finalize")
+        assert response.status_code == 400
+        assert not Photo.objects.exists()
+
+
+class TestStoredFileIndex(TemporaryMediaMixin, APITestCase):
+    media_files = ("apis/images/default.jpg",
+                   "accounts/images/default_profile_image.png")
+
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+
+    def test_upload_should_be_recorded_with_size_and_checksum(self):
+        self.client.force_authenticate(user=self.user)
+        data = {"garden_id": self.garden.id, "image": temporary_image()}
+        self.client.post("/api/photos", data=data)
+        photo = Photo.objects.get(garden_id=self.garden.id)
+        stored_file = StoredFile.objects.get(name=photo.image.name)
+        assert stored_file.size == photo.image.size
+        assert len(stored_file.checksum) == 64
+
+    def test_garden_image_should_be_hidden_if_file_is_not_stored(self):
+        photo = Photo.objects.create(
+            garden=self.garden, image="apis/images/missing.jpg", is_main_photo=True)
+        self.garden.refresh_main_photo()
+        response = self.client.get(f"/api/gardens/{self.garden.id}")
+        assert json.loads(response.content)["image"] is None
+
+        StoredFile.objects.create(name=photo.image.name, size=0, checksum="")
+        response = self.client.get(f"/api/gardens/{self.garden.id}")
+        assert json.loads(response.content)["image"] is not None
+
+    def test_reconcile_should_index_existing_files_and_drop_missing_ones(self):
+        StoredFile.objects.create(
+            name="apis/images/missing.jpg", size=0, checksum="")
+        call_command("reconcile_media", stdout=io.StringIO())
+        assert not StoredFile.objects.filter(
+            name="apis/images/missing.jpg").exists()
+        assert StoredFile.objects.filter(name="apis/images/default.jpg").exists()
+        assert StoredFile.objects.filter(
+            name="accounts/images/default_profile_image.png").exists()
+
+
+class TestImportRecords(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+
+    def import_file(self, kind, suffix, content, **options):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("import_records", kind, f.name,
+                     stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_should_import_users_and_report_invalid_rows(self):
+        stdout, stderr = self.import_file("users", ".csv", (
+            "email,password,nickname,experience\n"
+            "arya@stark.fr,valarmorghulis,Arya,3\n"
+            "hey@world.fr,,Taken,1\n"
+            "sansa@stark.fr,,Sansa,9\n"
+            "bran@stark.fr,,Bran,\n"
+        ), batch_size=2)
+        assert "2 users imported, 2 rows rejected" in stdout
+        assert "line 3: email: Email is already taken" in stderr
+        assert "line 4: experience:" in stderr
+        assert User.objects.get(email="arya@stark.fr").check_password(
+            "valarmorghulis")
+        assert not User.objects.get(email="bran@stark.fr").has_usable_password()
+
+    def test_batched_and_row_by_row_imports_should_count_references_alike(self):
+        name = User._meta.get_field("profile_image").default
+        StoredFile.objects.create(name=name, size=1, checksum="default")
+        content = "email,nickname\narya@stark.fr,Arya\nsansa@stark.fr,Sansa\n"
+        self.import_file("users", ".csv", content)
+        assert StoredFile.objects.get(name=name).ref_count == 2
+
+        content = "email,nickname\nbran@stark.fr,Bran\nrickon@stark.fr,Rickon\n"
+        with mock.patch.object(
+                User.objects, "bulk_create", side_effect=DatabaseError):
+            self.import_file("users", ".csv", content)
+        assert StoredFile.objects.get(name=name).ref_count == 4
+        jobs = Job.objects.filter(kind="image_variants", payload__name=name)
+        assert jobs.exclude(payload__pk=self.user.pk).count() == 4
+        assert set(User.objects.exclude(pk=self.user.pk).values_list(
+            "profile_image_status", flat=True)) == {"pending"}
+
+    def test_should_import_gardens_with_coordinates(self):
+        rows = [
+            {"user_email": "hey@world.fr", "title": "Potager",
+             "address": "1 rue Oberkampf", "zipcode": "75011"},
+            {"user_id": self.user.id, "title": "Verger",
+             "address": "2 rue Pelleport", "zipcode": "75020"},
+            {"user_email": "nobody@world.fr", "title": "Orphan",
+             "address": "3 rue Oberkampf", "zipcode": "75011"},
+            {"user_id": self.user.id, "title": "No address", "zipcode": "75011"},
+        ]
+        content = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+        stdout, stderr = self.import_file("gardens", ".ndjson", content)
+        assert "2 gardens imported, 3 rows rejected" in stdout
+        assert "line 3: user: User does not exist." in stderr
+        assert "line 4: address: This field cannot be blank." in stderr
+        assert "line 5: invalid row" in stderr
+        garden = Garden.objects.get(title="Potager")
+        assert garden.user_id == self.user.id
+        assert garden.geo_cell is not None
+
+
+class TestContentAddressedStorage(TemporaryMediaMixin, APITestCase):
+    media_files = ("apis/images/default.jpg",)
+
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.gardens = [
+            Garden.objects.create(user_id=self.user.id, title=title, zipcode="75001")
+            for title in ("toto", "tata")
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def upload_photo(self, garden, size=(120, 80)):
+        data = {"garden_id": garden.id, "image": temporary_image(size),
+                "is_main_photo": True}
+        response = self.client.post("/api/photos", data=data)
+        assert response.status_code == 201
+        return Photo.objects.get(pk=json.loads(response.content)["id"])
+
+    def test_identical_uploads_should_share_one_file(self):
+        first = self.upload_photo(self.gardens[0])
+        second = self.upload_photo(self.gardens[1])
+        assert first.image.name == second.image.name
+        stored_file = StoredFile.objects.get(name=first.image.name)
+        assert first.image.name == f"apis/images/{stored_file.checksum}.jpg"
+        assert stored_file.ref_count == 2
+
+        data = {"profile_image": temporary_image((120, 80))}
+        self.client.put(f"/api/users/{self.user.id}", data, format="multipart")
+        self.user.refresh_from_db()
+        assert self.user.profile_image.name == first.image.name
+        stored_file.refresh_from_db()
+        assert stored_file.ref_count == 3
+
+        other = self.upload_photo(self.gardens[1], size=(80, 120))
+        assert other.image.name != first.image.name
+
+    def test_unreferenced_files_should_be_collected(self):
+        first = self.upload_photo(self.gardens[0])
+        second = self.upload_photo(self.gardens[1])
+        name = first.image.name
+        self.client.delete(f"/api/photos/{first.id}")
+        call_command("collect_media", "--hours", "0", stdout=io.StringIO())
+        assert default_storage.exists(name)
+
+        self.client.delete(f"/api/photos/{second.id}")
+        assert StoredFile.objects.get(name=name).ref_count == 0
+        call_command("collect_media", stdout=io.StringIO())
+        assert default_storage.exists(name)
+        call_command("collect_media", "--hours", "0", stdout=io.StringIO())
+        assert not default_storage.exists(name)
+        assert not StoredFile.objects.filter(name=name).exists()
+
+    def test_collecting_should_keep_encodings_until_their_source_is_collected(self):
+        photo = self.upload_photo(self.gardens[0], size=(1200, 800))
+        call_command("run_jobs", "--once", stdout=io.StringIO())
+        photo.refresh_from_db()
+        derived = [*photo.variants["sizes"].values(),
+                   *StoredFile.objects.filter(
+                       name__startswith=encodings.ENCODINGS_DIRECTORY).values_list(
+                           "name", flat=True)]
+        assert len(derived) > len(photo.variants["sizes"])
+
+        call_command("collect_media", "--hours", "0", stdout=io.StringIO())
+        for name in derived:
+            assert default_storage.exists(name)
+        response = self.client.get(
+            f"/media/{photo.image.name}", HTTP_ACCEPT="image/webp,*/*")
+        assert response["Content-Type"] == "image/webp"
+
+        self.client.delete(f"/api/photos/{photo.id}")
+        call_command("collect_media", "--hours", "0", stdout=io.StringIO())
+        for name in [photo.image.name, *derived]:
+            assert not default_storage.exists(name)
+            assert not StoredFile.objects.filter(name=name).exists()
+
+    def test_uploading_a_variant_should_not_reuse_the_variant_file(self):
+        photo = self.upload_photo(self.gardens[0], size=(1200, 800))
+        call_command("run_jobs", "--once", stdout=io.StringIO())
+        photo.refresh_from_db()
+        variant = photo.variants["sizes"]["320"]
+        with default_storage.open(variant) as variant_file:
+            content = variant_file.read()
+
+        data = {"garden_id": self.gardens[1].id, "is_main_photo": True,
+                "image": ContentFile(content, name="thumbnail.jpg")}
+        response = self.client.post("/api/photos", data=data)
+        assert response.status_code == 201
+        copy = Photo.objects.get(pk=json.loads(response.content)["id"])
+        assert copy.image.name != variant
+        assert storage.is_upload(copy.image.name)
+
+    def test_upload_should_write_a_file_collected_while_it_was_deduplicated(self):
+        first = self.upload_photo(self.gardens[0])
+        name = first.image.name
+        self.client.delete(f"/api/photos/{first.id}")
+        exists = storage.ContentAddressedStorage.exists
+
+        def collect_after_lookup(storage_self, checked_name):
+            # collect_media runs between the checksum lookup and the touch.
+            found = exists(storage_self, checked_name)
+            if checked_name == name and found:
+                call_command("collect_media", "--hours", "0", stdout=io.StringIO())
+            return found
+
+        with mock.patch.object(
+                storage.ContentAddressedStorage, "exists", collect_after_lookup):
+            second = self.upload_photo(self.gardens[1])
+        assert second.image.name == name
+        assert default_storage.exists(name)
+        assert StoredFile.objects.get(name=name).ref_count == 1
+
+    def test_reconcile_should_recount_references(self):
+        photo = self.upload_photo(self.gardens[0])
+        StoredFile.objects.update(ref_count=7)
+        call_command("reconcile_media", stdout=io.StringIO())
+        assert StoredFile.objects.get(name=photo.image.name).ref_count == 1
+        assert StoredFile.objects.get(name="apis/images/default.jpg").ref_count == 0
+
+
+class TestBatchPhotoUpload(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_should_save_every_valid_file_in_one_request(self):
+        not_an_image = io.BytesIO(b"not an image")
+        not_an_image.name = "notes.txt"
+        data = {
+            "garden_id": self.garden.id,
+            "season": 2,
+            "main_photo_index": 1,
+            "images": [temporary_image((120, 80)), temporary_image((80, 120)),
+                       not_an_image, temporary_image((120, 80))],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/photos/batch", data=data)
+        assert response.status_code == 201
+        results = json.loads(response.content)["results"]
+        assert [("photo" in result) for result in results] == [
+            True, True, False, True]
+        assert "errors" in results[2]
+        assert len([query for query in queries
+                    if query["sql"].startswith('INSERT INTO "apis_photo"')]) == 1
+
+        photos = Photo.objects.filter(garden=self.garden).order_by("id")
+        assert [photo.season for photo in photos] == [2, 2, 2]
+        self.garden.refresh_from_db()
+        assert self.garden.main_photo_id == results[1]["photo"]["id"]
+        assert results[1]["photo"]["is_main_photo"]
+        assert StoredFile.objects.get(name=photos[0].image.name).ref_count == 2
+        assert Job.objects.filter(
+            kind="image_variants", payload__model="apis.Photo",
+            payload__pk__in=[photo.pk for photo in photos]).count() == 3
+
+        jobs.run_pending()
+        assert {photo.processing_status
+                for photo in Photo.objects.filter(garden=self.garden)} == {"ready"}
+
+    def test_should_reject_batches_for_gardens_of_other_users(self):
+        self.client.force_authenticate(user=UserFactory.create_user())
+        data = {"garden_id": self.garden.id, "images": [temporary_image()]}
+        response = self.client.post("/api/photos/batch", data=data)
+        assert response.status_code == 403
+
+    def test_should_reject_batches_without_valid_images(self):
+        data = {"garden_id": self.garden.id}
+        response = self.client.post("/api/photos/batch", data=data)
+        assert response.status_code == 400
+
+        not_an_image = io.BytesIO(b"not an image")
+        not_an_image.name = "notes.txt"
+        data = {"garden_id": self.garden.id, "images": [not_an_image]}
+        response = self.client.post("/api/photos/batch", data=data)
+        assert response.status_code == 400
+        assert not Photo.objects.exists()
+
+
+class TestServeMedia(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.content = temporary_image((120, 80)).read()
+        self.name = default_storage.save(
+            "apis/images/photo.jpg", ContentFile(self.content))
+        storage.acquire(self.name)
+        self.url = f"/media/{self.name}"
+
+    def test_should_serve_indexed_files_with_long_lived_cache_headers(self):
+        response = self.client.get(self.url)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == self.content
+        assert response["Content-Type"] == "image/jpeg"
+        assert response["Accept-Ranges"] == "bytes"
+        assert "immutable" in response["Cache-Control"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+
+    def test_should_only_serve_indexed_files(self):
+        assert self.client.get("/media/core/settings.py").status_code == 404
+        assert self.client.get("/media/apis/images/../../manage.py").status_code == 404
+
+    def test_should_only_serve_referenced_files_and_their_variants(self):
+        storage.release(self.name)
+        assert self.client.get(self.url).status_code == 404
+
+        default_storage.save("apis/incoming/upload.part", ContentFile(b"part"))
+        assert StoredFile.objects.filter(name="apis/incoming/upload.part").exists()
+        assert self.client.get("/media/apis/incoming/upload.part").status_code == 404
+
+        name = default_storage.save(
+            "apis/images/photo.jpg", ContentFile(temporary_image((800, 600)).read()))
+        sizes = variants.generate_variants(Photo(image=name).image)
+        variant_url = f"/media/{sizes[min(sizes)]}"
+        assert self.client.get(variant_url).status_code == 404
+        storage.acquire(name)
+        assert self.client.get(variant_url).status_code == 200
+
+    def test_last_modified_should_not_move_with_references(self):
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        with mock.patch("django.utils.timezone.now", return_value=(
+                timezone.now() + timezone.timedelta(days=1))):
+            storage.acquire(self.name)
+        assert self.client.get(self.url)["Last-Modified"] == last_modified
+
+    def test_should_serve_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        assert response.status_code == 206
+        assert b"".join(response.streaming_content) == self.content[10:20]
+        assert response["Content-Range"] == f"bytes 10-19/{len(self.content)}"
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        assert b"".join(response.streaming_content) == self.content[-5:]
+
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"stale"')
+        assert response.status_code == 200
+
+        response = self.client.get(
+            self.url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        assert response.status_code == 416
+
+    def test_should_serve_the_best_encoding_the_client_accepts(self):
+        self.content = temporary_image((1200, 800)).read()
+        name = default_storage.save(
+            "apis/images/photo.jpg", ContentFile(self.content))
+        storage.acquire(name)
+        encodings.encode(default_storage, [name])
+        encodings.encode(default_storage, [name])
+        image_formats = encodings.supported_formats()
+        assert StoredFile.objects.filter(
+            name__startswith=encodings.ENCODINGS_DIRECTORY).count() == len(image_formats)
+
+        content_types = [
+            encodings.FORMATS[image_format]["content_type"]
+            for image_format in image_formats]
+        response = self.client.get(
+            f"/media/{name}",
+            HTTP_ACCEPT=",".join(reversed(content_types)) + ",image/*,*/*;q=0.8")
+        assert response["Content-Type"] == content_types[0]
+        assert "Accept" in response["Vary"]
+        encoded = b"".join(response.streaming_content)
+        assert len(encoded) < len(self.content)
+        encoded_etag = response["ETag"]
+
+        response = self.client.get(f"/media/{name}", HTTP_ACCEPT="image/*,*/*")
+        assert response["Content-Type"] == "image/jpeg"
+        assert "Accept" in response["Vary"]
+        assert response["ETag"] != encoded_etag
+
+        response = self.client.get(
+            f"/media/{name}", HTTP_ACCEPT=f"{content_types[0]};q=0,*/*")
+        assert response["Content-Type"] == "image/jpeg"
+
+    def test_should_not_retry_encodings_that_were_not_smaller(self):
+        # Any encoding is bigger than a 1-byte source.
+        StoredFile.objects.filter(name=self.name).update(size=1)
+        encodings.encode(default_storage, [self.name])
+        assert StoredFile.objects.get(name=self.name).rejected_encodings == sorted(
+            encodings.supported_formats())
+        assert not StoredFile.objects.filter(
+            name__startswith=encodings.ENCODINGS_DIRECTORY).exists()
+
+        with mock.patch.object(encodings, "encode_file") as encode_file:
+            encodings.encode(default_storage, [self.name])
+        encode_file.assert_not_called()
+
+    @override_settings(MEDIA_ACCEL="nginx")
+    def test_should_hand_off_transfers_to_nginx(self):
+        response = self.client.get(self.url)
+        assert response.status_code == 200
+        assert response["X-Accel-Redirect"] == f"/protected-media/{self.name}"
+        assert response.content == b""
+
+    def test_api_should_link_to_the_media_view(self):
+        user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        garden = Garden.objects.create(user=user, title="toto", zipcode="75001")
+        Photo.objects.create(garden=garden, image=self.name, is_main_photo=True)
+        garden.refresh_main_photo()
+        response = self.client.get(f"/api/gardens/{garden.id}")
+        image = json.loads(response.content)["image"]
+        assert image == f"http://testserver{self.url}"
+
+
+class TestListPhotos(TemporaryMediaMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
         self.garden = Garden.objects.create(
@@ -330,7 +1305,7 @@ class TestListPhotos(APITestCase):
         assert self.garden2.id not in garden_id_list
 
 
-class TestUpdatePhotos(APITestCase):
+class TestUpdatePhotos(TemporaryMediaMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
         self.garden = Garden.objects.create(
@@ -379,6 +1354,252 @@ class TestUpdatePhotos(APITestCase):
         assert response.status_code == 403
 
 
+class TestGardenMainPhoto(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload_photo(self, is_main_photo):
+        data = {"garden_id": self.garden.id, "image": temporary_image(),
+                "is_main_photo": is_main_photo}
+        response = self.client.post("/api/photos", data=data)
+        assert response.status_code == 201
+        return json.loads(response.content)["id"]
+
+    def test_first_photo_should_be_used_until_one_is_flagged_as_main(self):
+        first_photo_id = self.upload_photo(False)
+        self.upload_photo(False)
+        self.garden.refresh_from_db()
+        assert self.garden.main_photo_id == first_photo_id
+
+    def test_flagging_a_photo_as_main_should_unflag_the_previous_one(self):
+        first_photo_id = self.upload_photo(True)
+        second_photo_id = self.upload_photo(True)
+        self.garden.refresh_from_db()
+        assert self.garden.main_photo_id == second_photo_id
+        assert not Photo.objects.get(pk=first_photo_id).is_main_photo
+
+        response = self.client.patch(
+            f"/api/photos/{first_photo_id}", data={"is_main_photo": True})
+        assert response.status_code == 200
+        self.garden.refresh_from_db()
+        assert self.garden.main_photo_id == first_photo_id
+        assert not Photo.objects.get(pk=second_photo_id).is_main_photo
+
+    def test_deleting_the_main_photo_should_fall_back_to_another_one(self):
+        first_photo_id = self.upload_photo(False)
+        second_photo_id = self.upload_photo(True)
+        response = self.client.delete(f"/api/photos/{second_photo_id}")
+        assert response.status_code == 204
+        self.garden.refresh_from_db()
+        assert self.garden.main_photo_id == first_photo_id
+
+    def test_should_not_allow_non_garden_owner_to_delete_photos(self):
+        photo_id = self.upload_photo(True)
+        self.client.force_authenticate(user=UserFactory.create_user())
+        response = self.client.delete(f"/api/photos/{photo_id}")
+        assert response.status_code == 403
+        assert Photo.objects.filter(pk=photo_id).exists()
+
+    def test_database_should_reject_two_main_photos_for_a_garden(self):
+        Photo.objects.create(garden=self.garden, is_main_photo=True)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Photo.objects.create(garden=self.garden, is_main_photo=True)
+
+
+class TestImageVariants(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload_photo(self, size):
+        data = {"garden_id": self.garden.id, "image": temporary_image(size),
+                "is_main_photo": True}
+        response = self.client.post("/api/photos", data=data)
+        assert response.status_code == 201
+        return json.loads(response.content)
+
+    def get_photo(self, photo_id):
+        response = self.client.get(f"/api/photos/{photo_id}")
+        return json.loads(response.content)
+
+    def test_variants_should_be_generated_in_the_background(self):
+        photo = self.upload_photo((1000, 750))
+        assert photo["processing_status"] == "pending"
+        assert photo["variants"] == {}
+
+        jobs.run_pending()
+        photo = self.get_photo(photo["id"])
+        assert photo["processing_status"] == "ready"
+        assert sorted(photo["variants"]) == ["320", "640"]
+        variant = Photo.objects.get(pk=photo["id"]).variants["sizes"]["320"]
+        assert StoredFile.objects.filter(name=variant).exists()
+        checksum = StoredFile.objects.get(name=variant).checksum
+        assert StoredFile.objects.filter(
+            name=encodings.encoding_name(checksum, "WEBP")).exists()
+        with default_storage.open(variant) as f, Image.open(f) as image:
+            assert image.size == (320, 240)
+
+        response = self.client.get(f"/api/gardens/{self.garden.id}")
+        image_variants = json.loads(response.content)["image_variants"]
+        assert image_variants["640"].endswith("_640w.jpg")
+
+    def test_unindexed_leftover_variants_should_be_written_again(self):
+        photo = self.upload_photo((1000, 750))
+        name = Photo.objects.get(pk=photo["id"]).image.name
+        leftover = variants.variant_name(name, 320, "jpg")
+        default_storage.save(leftover, ContentFile(b"crashed"))
+        StoredFile.objects.filter(name=leftover).delete()
+
+        jobs.run_pending()
+        stored_file = StoredFile.objects.get(name=leftover)
+        assert stored_file.size != len(b"crashed")
+        response = self.client.get(f"/media/{leftover}")
+        assert response.status_code == 200
+
+    def test_small_images_should_have_no_variants(self):
+        photo = self.upload_photo((100, 100))
+        jobs.run_pending()
+        photo = self.get_photo(photo["id"])
+        assert photo["processing_status"] == "ready"
+        assert photo["variants"] == {}
+
+    def test_backfill_should_generate_missing_variants(self):
+        photo = self.upload_photo((700, 700))
+        jobs.run_pending()
+        Photo.objects.filter(pk=photo["id"]).update(variants={})
+        User.objects.filter(pk=self.user.pk).update(
+            profile_image=Photo.objects.get(pk=photo["id"]).image.name,
+            profile_image_variants={})
+
+        stdout = io.StringIO()
+        call_command("generate_image_variants", stdout=stdout)
+        assert "1 photos and 1 profile images updated" in stdout.getvalue()
+        assert sorted(Photo.objects.get(pk=photo["id"]).variants["sizes"]) == [
+            "320", "640"]
+
+        response = self.client.get(f"/api/users/{self.user.id}")
+        profile_image_variants = json.loads(
+            response.content)["profile_image_variants"]
+        assert sorted(profile_image_variants) == ["320", "640"]
+
+
+class TestJobQueue(TemporaryMediaMixin, APITestCase):
+    media_files = ("apis/images/default.jpg",)
+
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.garden = Garden.objects.create(
+            user_id=self.user.id, title="toto", zipcode="75001"
+        )
+        Job.objects.all().delete()
+
+    def test_failed_jobs_should_be_retried_until_their_last_attempt(self):
+        photo = Photo.objects.create(
+            garden=self.garden, image="apis/images/missing.jpg",
+            is_main_photo=True)
+        job = Job.objects.get()
+        assert job.payload["pk"] == photo.pk
+        assert Photo.objects.get(pk=photo.pk).processing_status == "pending"
+
+        jobs.run_pending()
+        job.refresh_from_db()
+        assert job.status == Job.Status.QUEUED
+        assert job.attempts == 1
+        assert "FileNotFoundError" in job.last_error
+        assert jobs.claim() == []
+
+        Job.objects.update(available_at=timezone.now(), attempts=4)
+        jobs.run_pending()
+        job.refresh_from_db()
+        assert job.status == Job.Status.FAILED
+        assert Photo.objects.get(pk=photo.pk).processing_status == "failed"
+
+    def test_jobs_whose_worker_died_on_their_last_attempt_should_fail(self):
+        photo = Photo.objects.create(
+            garden=self.garden, image="apis/images/default.jpg",
+            is_main_photo=True)
+        other_photo = Photo.objects.create(
+            garden=self.garden, image="apis/images/default.jpg",
+            is_main_photo=False)
+        job = Job.objects.get(payload__pk=photo.pk)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.Status.RUNNING, attempts=job.max_attempts,
+            available_at=timezone.now() - timezone.timedelta(seconds=1))
+
+        with self.assertLogs("apis.jobs", "ERROR"):
+            assert jobs.run_pending() == 1
+        job.refresh_from_db()
+        assert job.status == Job.Status.FAILED
+        assert job.attempts == job.max_attempts
+        assert "worker stopped" in job.last_error
+        assert Photo.objects.get(pk=photo.pk).processing_status == "failed"
+        assert Photo.objects.get(pk=other_photo.pk).processing_status == "ready"
+
+    def test_an_error_in_on_failure_should_still_fail_the_job(self):
+        def on_failure(**payload):
+            raise RuntimeError("on_failure is broken")
+
+        def broken(**payload):
+            raise RuntimeError("broken")
+
+        jobs.handler("broken", on_failure=on_failure)(broken)
+        self.addCleanup(jobs.handlers.pop, "broken")
+        job = jobs.enqueue("broken")
+        Job.objects.filter(pk=job.pk).update(attempts=job.max_attempts - 1)
+
+        with self.assertLogs("apis.jobs", "ERROR") as logs:
+            assert jobs.run_pending() == 1
+        job.refresh_from_db()
+        assert job.status == Job.Status.FAILED
+        assert "on_failure is broken" in "\n".join(logs.output)
+
+        jobs.enqueue("broken")
+        Job.objects.filter(status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING, attempts=job.max_attempts)
+        with self.assertLogs("apis.jobs", "ERROR"):
+            assert jobs.claim() == []
+        assert not Job.objects.exclude(status=Job.Status.FAILED).exists()
+
+    def test_jobs_claimed_by_a_dead_worker_should_be_visible_again(self):
+        Photo.objects.create(
+            garden=self.garden, image="apis/images/default.jpg",
+            is_main_photo=True)
+        assert len(jobs.claim()) == 1
+        assert jobs.claim() == []
+
+        Job.objects.update(available_at=timezone.now())
+        [job] = jobs.claim()
+        assert job.attempts == 2
+        assert jobs.run(job) == Job.Status.DONE
+
+    def test_unchanged_images_should_not_be_queued_again(self):
+        photo = Photo.objects.create(
+            garden=self.garden, image="apis/images/default.jpg",
+            is_main_photo=True)
+        photo.season = 2
+        photo.save()
+        assert Job.objects.count() == 1
+
+        call_command("run_jobs", "--once", stdout=io.StringIO())
+        photo.refresh_from_db()
+        photo.save()
+        assert Job.objects.count() == 1
+
+    @override_settings(CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_worker_should_refuse_a_cache_local_to_its_process(self):
+        with self.assertRaises(CommandError):
+            call_command("run_jobs", "--once", stdout=io.StringIO())
+
+
 class TestListConversationsWithLatestMessage(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
@@ -404,19 +1625,24 @@ class TestListConversationsWithLatestMessage(APITestCase):
         response = self.client.get("/api/conversations")
         assert response.status_code == 401
 
-    def test_should_return_403_if_not_part_of_the_conversation(self):
+    def test_should_not_list_conversations_of_other_users(self):
         self.user3 = User.objects.create_user(
             "test@test.test", "testingtesting")
         self.client.force_authenticate(user=self.user3)
         response = self.client.get(
-            f"/api/conversations?current_user_id={self.user3.id}")
-        assert response.status_code == 403
+            f"/api/conversations?current_user_id={self.user.id}")
+        assert response.status_code == 200
+        assert response.json()["results"] == []
 
-    def test_should_return_403_if_the_query_param_is_not_provided(self):
+    def test_should_list_the_inbox_of_the_authenticated_user(self):
         self.client.force_authenticate(user=self.user)
-        response = self.client.get(
-            "/api/conversations")
-        assert response.status_code == 403
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/conversations")
+        assert response.status_code == 200
+        assert [item["id"] for item in response.json()["results"]] == [
+            self.conversation.id]
+        # The count and the page, without loading the inbox to check access.
+        assert len(queries) == 2
 
     def test_should_return_the_latest_message_of_conversation(self):
         self.client.force_authenticate(user=self.user)
@@ -430,11 +1656,13 @@ class TestListConversationsWithLatestMessage(APITestCase):
         assert self.message.content not in latest_message_list
 
     def test_should_list_all_conversations_with_latest_message_for_the_given_user(self):
+        self.user3 = User.objects.create_user(
+            "test@test.test", "testingtesting")
         self.conversation2 = Conversation.objects.create(
-            chat_sender_id=self.user2.id, chat_receiver_id=self.user.id
+            chat_sender_id=self.user3.id, chat_receiver_id=self.user.id
         )
         self.message3 = Message.objects.create(
-            sender_id=self.user2.id,
+            sender_id=self.user3.id,
             content="Another msg",
             conversation_id=self.conversation2.id,
         )
@@ -450,8 +1678,10 @@ class TestListConversationsWithLatestMessage(APITestCase):
         assert self.message3.content in latest_message_list
 
     def test_should_return_empty_object_if_no_latest_message(self):
+        self.user3 = User.objects.create_user(
+            "test@test.test", "testingtesting")
         self.conversation2 = Conversation.objects.create(
-            chat_sender_id=self.user2.id, chat_receiver_id=self.user.id)
+            chat_sender_id=self.user3.id, chat_receiver_id=self.user2.id)
         self.client.force_authenticate(user=self.user2)
         response = self.client.get(
             f"/api/conversations?current_user_id={self.user2.id}")
@@ -460,6 +1690,48 @@ class TestListConversationsWithLatestMessage(APITestCase):
             item["latest_message"] for item in json_response["results"]]
         assert {} in latest_messages
 
+    def test_should_list_the_inbox_without_a_query_per_conversation(self):
+        self.client.force_authenticate(user=self.user)
+        url = f"/api/conversations?current_user_id={self.user.id}&cursor="
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            assert response.status_code == 200
+            return len(queries)
+
+        expected = count_queries()
+        for i in range(5):
+            user = User.objects.create_user(f"inbox-{i}@world.fr", "hekolololololo")
+            conversation = Conversation.objects.create(
+                chat_sender=self.user, chat_receiver=user)
+            Message.objects.create(
+                conversation=conversation, sender=user, content="Hi")
+        assert count_queries() == expected
+
+    def test_should_not_replace_the_latest_message_with_an_older_one(self):
+        Message.objects.create(
+            sender_id=self.user2.id,
+            content="Delivered late",
+            conversation_id=self.conversation.id,
+            sent_at=timezone.now() - timezone.timedelta(hours=2),
+        )
+        self.conversation.refresh_from_db()
+        assert self.conversation.last_message_id == self.message2.id
+        assert self.conversation.last_message_preview == "Latest msg"
+        assert self.conversation.last_message_sender_id == self.user.id
+
+    def test_should_fall_back_to_the_previous_message_when_the_latest_is_deleted(self):
+        self.message2.delete()
+        self.conversation.refresh_from_db()
+        assert self.conversation.last_message_id == self.message.id
+        assert self.conversation.last_message_preview == "Hello there"
+        assert self.conversation.last_message_at == self.message.sent_at
+
+        self.message.delete()
+        self.conversation.refresh_from_db()
+        assert self.conversation.last_message_id is None
+
 
 class TestShowConversationWithAllMessages(APITestCase):
     def setUp(self):
@@ -495,6 +1767,23 @@ class TestShowConversationWithAllMessages(APITestCase):
             f"/api/conversations/{self.conversation.id}")
         assert response.status_code == 403
 
+    def test_should_return_404_for_a_non_numeric_id(self):
+        self.client.force_authenticate(user=self.user)
+        for url in ("/api/conversations/abc", "/api/conversations/abc/messages"):
+            assert self.client.get(url).status_code == 404, url
+        response = self.client.post("/api/conversations/abc/read")
+        assert response.status_code == 404
+
+    def test_should_check_membership_with_a_single_exists_query(self):
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f"/api/conversations/{self.conversation.id}")
+        assert response.status_code == 200
+        assert queries[0]["sql"].startswith("SELECT 1 AS")
+        assert sum('"apis_conversation"' in query["sql"]
+                   for query in queries) == 2
+
     def test_should_return_all_messages_for_the_given_conversation(self):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(
@@ -530,6 +1819,170 @@ class TestShowConversationWithAllMessages(APITestCase):
         assert json_response["messages"] == []
 
 
+class TestMessageHistory(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.user2 = User.objects.create_user(
+            "hola@world.fr", "hekolololololo")
+        self.conversation = Conversation.objects.create(
+            chat_sender_id=self.user.id, chat_receiver_id=self.user2.id
+        )
+        start = timezone.now() - timezone.timedelta(hours=1)
+        self.messages = [
+            Message.objects.create(
+                sender_id=self.user.id,
+                content=f"msg {i}",
+                conversation_id=self.conversation.id,
+                sent_at=start + timezone.timedelta(minutes=i),
+            )
+            for i in range(5)
+        ]
+        self.url = f"/api/conversations/{self.conversation.id}/messages"
+
+    def contents(self, response):
+        assert response.status_code == 200
+        return [message["content"] for message in response.json()["results"]]
+
+    def test_should_return_403_if_not_part_of_the_conversation(self):
+        user3 = User.objects.create_user("test@test.test", "testingtesting")
+        self.client.force_authenticate(user=user3)
+        assert self.client.get(self.url).status_code == 403
+
+    def test_should_page_through_the_history_newest_first(self):
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(self.url, {"limit": 2})
+        assert self.contents(response) == ["msg 4", "msg 3"]
+        assert "count" not in response.json()
+        response = self.client.get(response.json()["next"])
+        assert self.contents(response) == ["msg 2", "msg 1"]
+        response = self.client.get(response.json()["next"])
+        assert self.contents(response) == ["msg 0"]
+        assert response.json()["next"] is None
+
+    def test_should_only_return_messages_after_the_given_one(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(
+            self.url, {"after_id": self.messages[2].id})
+        assert self.contents(response) == ["msg 4", "msg 3"]
+
+    def test_should_only_return_messages_since_the_given_time(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(
+            self.url, {"since": self.messages[3].sent_at.isoformat()})
+        assert self.contents(response) == ["msg 4"]
+
+    def test_should_reject_an_invalid_since(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url, {"since": "yesterday"})
+        assert response.status_code == 400
+
+    def test_should_reject_an_after_id_from_another_conversation(self):
+        user3 = User.objects.create_user("test@test.test", "testingtesting")
+        other = Conversation.objects.create(chat_sender=user3, chat_receiver=self.user)
+        message = Message.objects.create(
+            sender=user3, conversation=other, content="Hi")
+        self.client.force_authenticate(user=self.user)
+        for after_id in (message.id, 10 ** 30, "last"):
+            response = self.client.get(self.url, {"after_id": after_id})
+            assert response.status_code == 400, after_id
+
+    def test_should_return_404_for_a_tampered_cursor(self):
+        self.client.force_authenticate(user=self.user)
+        cursor = base64.urlsafe_b64encode(b'["now", "one"]').decode()
+        response = self.client.get(self.url, {"cursor": cursor})
+        assert response.status_code == 404
+
+    def test_should_bound_the_messages_embedded_in_the_conversation(self):
+        self.client.force_authenticate(user=self.user)
+        Message.objects.bulk_create(
+            Message(sender=self.user, conversation=self.conversation,
+                    content="old", sent_at=self.messages[0].sent_at)
+            for i in range(60)
+        )
+        response = self.client.get(
+            f"/api/conversations/{self.conversation.id}"
+            f"?current_user_id={self.user.id}")
+        messages = response.json()["messages"]
+        assert len(messages) == 50
+        assert messages[0]["content"] == "msg 4"
+
+
+class TestReadState(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.user2 = User.objects.create_user(
+            "hola@world.fr", "hekolololololo")
+        self.conversation = Conversation.objects.create(
+            chat_sender_id=self.user.id, chat_receiver_id=self.user2.id
+        )
+
+    def send(self, sender, content="Hello"):
+        return Message.objects.create(
+            sender=sender, conversation=self.conversation, content=content)
+
+    def test_should_count_messages_the_other_participant_has_not_read(self):
+        first = self.send(self.user)
+        self.send(self.user)
+        self.conversation.refresh_from_db()
+        assert self.conversation.chat_receiver_unread == 2
+        assert self.conversation.chat_sender_unread == 0
+        assert self.conversation.chat_sender_last_read_id is not None
+        assert self.conversation.chat_receiver_last_read_id is None
+
+        # Answering reads the conversation.
+        reply = self.send(self.user2)
+        self.conversation.refresh_from_db()
+        assert self.conversation.chat_receiver_unread == 0
+        assert self.conversation.chat_receiver_last_read_id == reply.id
+        assert self.conversation.chat_sender_unread == 1
+        assert self.conversation.chat_sender_last_read_id > first.id
+
+    def test_should_mark_the_conversation_read_with_one_update(self):
+        message = self.send(self.user)
+        self.client.force_authenticate(user=self.user2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f"/api/conversations/{self.conversation.id}/read")
+        assert response.status_code == 204
+        assert len(queries) == 1
+        assert queries[0]["sql"].startswith("UPDATE")
+        self.conversation.refresh_from_db()
+        assert self.conversation.chat_receiver_unread == 0
+        assert self.conversation.chat_receiver_last_read_id == message.id
+
+    def test_should_return_404_when_marking_someone_elses_conversation(self):
+        user3 = User.objects.create_user("test@test.test", "testingtesting")
+        self.client.force_authenticate(user=user3)
+        response = self.client.post(
+            f"/api/conversations/{self.conversation.id}/read")
+        assert response.status_code == 404
+
+    def test_should_not_count_a_deleted_unread_message(self):
+        self.send(self.user)
+        self.send(self.user).delete()
+        self.conversation.refresh_from_db()
+        assert self.conversation.chat_receiver_unread == 1
+
+    def test_should_serve_unread_counts_without_counting_messages(self):
+        user3 = User.objects.create_user("test@test.test", "testingtesting")
+        other = Conversation.objects.create(chat_sender=user3, chat_receiver=self.user2)
+        self.send(self.user)
+        Message.objects.create(sender=user3, conversation=other, content="Hi")
+        Message.objects.create(sender=user3, conversation=other, content="Hi")
+        self.client.force_authenticate(user=self.user2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/conversations/unread")
+        assert response.json() == {"unread_count": 3}
+        assert not any('"apis_message"' in query["sql"] for query in queries)
+
+        response = self.client.get(
+            f"/api/conversations?current_user_id={self.user2.id}")
+        counts = {item["id"]: item["unread_count"]
+                  for item in response.json()["results"]}
+        assert counts == {self.conversation.id: 1, other.id: 2}
+
+
 class TestCreateConversation(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
@@ -567,6 +2020,46 @@ class TestCreateConversation(APITestCase):
         assert json_response["error"] == "Conversation already exists between these two users"
         assert json_response["conversation_id"] == str(self.conversation.id)
 
+    def test_should_return_400_if_the_other_user_started_the_conversation(self):
+        self.conversation = Conversation.objects.create(
+            chat_sender_id=self.user2.id, chat_receiver_id=self.user.id)
+        self.client.force_authenticate(user=self.user)
+        data = {"chat_receiver_id": self.user2.id}
+        response = self.client.post(
+            "/api/conversations", data=data, format="json")
+        assert response.status_code == 400
+        assert response.json()["conversation_id"] == str(self.conversation.id)
+
+    def test_should_not_store_two_conversations_for_a_pair_of_users(self):
+        Conversation.objects.create(
+            chat_sender_id=self.user.id, chat_receiver_id=self.user2.id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(
+                chat_sender_id=self.user2.id, chat_receiver_id=self.user.id)
+
+    def test_should_open_a_conversation_once(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            "/api/conversations/open", {"user_id": self.user2.id}, format="json")
+        assert response.status_code == 201
+        conversation_id = response.json()["id"]
+        assert response.json()["chat_sender_id"] == self.user.id
+
+        self.client.force_authenticate(user=self.user2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/conversations/open", {"user_id": self.user.id}, format="json")
+        assert response.status_code == 200
+        assert response.json()["id"] == conversation_id
+        assert len(queries) == 1
+        assert Conversation.objects.count() == 1
+
+    def test_should_not_open_a_conversation_with_an_unknown_user(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            "/api/conversations/open", {"user_id": 0}, format="json")
+        assert response.status_code == 400
+
 
 class TestCreatePrivateMessages(APITestCase):
     def setUp(self):
@@ -604,3 +2097,273 @@ class TestCreatePrivateMessages(APITestCase):
         assert json_response["content"] == data["content"]
         assert json_response["sender_id"] == self.user.id
         assert json_response["sent_at"] is not None
+
+    def test_sending_a_message_should_only_insert_it_and_touch_the_conversation(self):
+        self.client.force_authenticate(user=self.user)
+        data = {"conversation_id": self.conversation.id, "content": "Hello"}
+        before = self.conversation.updated_at
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/messages", data=data, format="json")
+        assert response.status_code == 201
+        # The participant check, the insert and one targeted update.
+        assert len(queries) == 3
+        assert queries[2]["sql"].startswith('UPDATE "apis_conversation" SET "updated_at"')
+        self.conversation.refresh_from_db()
+        assert self.conversation.updated_at > before
+
+    def test_editing_a_message_should_not_read_it_back(self):
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.user, content="Hello")
+        message = Message.objects.get(pk=message.pk)
+        with CaptureQueriesContext(connection) as queries:
+            message.save()
+        assert len(queries) == 1
+
+        with CaptureQueriesContext(connection) as queries:
+            message.content = "Hello World"
+            message.save()
+        # The message itself, then the preview if it is the latest one.
+        assert len(queries) == 2
+        assert all(query["sql"].startswith("UPDATE") for query in queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            message.sent_at = timezone.now()
+            message.save()
+        assert len(queries) == 2
+
+
+class TestRealtimeEvents(APITransactionTestCase):
+    # The stream closes the connection around its authentication query,
+    # which would end a test case's transaction.
+
+    def setUp(self):
+        self.user = User.objects.create_user("hey@world.fr", "hekolololololo")
+        self.user2 = User.objects.create_user(
+            "hola@world.fr", "hekolololololo")
+        self.conversation = Conversation.objects.create(
+            chat_sender_id=self.user.id, chat_receiver_id=self.user2.id
+        )
+
+    def connect(self, query_string=b"", headers=()):
+        return ApplicationCommunicator(application, {
+            "type": "http",
+            "method": "GET",
+            "path": "/api/events",
+            "query_string": query_string,
+            "headers": list(headers),
+        })
+
+    def send_message(self):
+        self.client.force_authenticate(user=self.user)
+        data = {"conversation_id": self.conversation.id, "content": "Hello"}
+        response = self.client.post("/api/messages", data=data, format="json")
+        assert response.status_code == 201
+        return response.json()
+
+    def start(self, *args, **kwargs):
+        async def request():
+            communicator = self.connect(*args, **kwargs)
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output()
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait()
+            return start
+
+        return async_to_sync(request)()
+
+    def test_should_return_401_without_a_token(self):
+        assert self.start()["status"] == 401
+
+    def test_should_allow_whitelisted_origins(self):
+        token = Token.objects.create(user=self.user).key
+        start = self.start(f"token={token}".encode(),
+                           [(b"origin", b"http://localhost:5173")])
+        assert start["status"] == 200
+        assert (b"access-control-allow-origin",
+                b"http://localhost:5173") in start["headers"]
+
+        start = self.start(headers=[(b"origin", b"http://localhost:5173")])
+        assert start["status"] == 401
+        assert (b"access-control-allow-origin",
+                b"http://localhost:5173") in start["headers"]
+
+        start = self.start(f"token={token}".encode(),
+                           [(b"origin", b"http://evil.example")])
+        assert b"access-control-allow-origin" not in dict(start["headers"])
+
+    def test_should_push_new_messages_to_both_participants(self):
+        tokens = [Token.objects.create(user=user).key
+                  for user in (self.user, self.user2)]
+
+        async def receive_pushed_message():
+            communicators = [
+                self.connect(f"token={token}".encode()) for token in tokens]
+            for communicator in communicators:
+                await communicator.send_input({"type": "http.request"})
+                start = await communicator.receive_output()
+                assert start["status"] == 200
+                assert (await communicator.receive_output())["body"].startswith(b":")
+            message = await sync_to_async(self.send_message)()
+            bodies = [(await communicator.receive_output())["body"]
+                      for communicator in communicators]
+            for communicator in communicators:
+                await communicator.send_input({"type": "http.disconnect"})
+                await communicator.wait()
+            return message, bodies
+
+        message, bodies = async_to_sync(receive_pushed_message)()
+        for body in bodies:
+            lines = body.decode().splitlines()
+            assert lines[0] == f"id: {message['id']}"
+            assert lines[1] == "event: message"
+            assert json.loads(lines[2][len("data: "):]) == message
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN checks need Postgres")
+class TestQueryPlans(APITestCase):
+    """Run each endpoint against realistic volumes and fail if one of its
+    queries scans or sorts a whole table instead of using an index."""
+
+    GARDENS = COMMENTS = CONVERSATIONS = PHOTOS = 20000
+    MESSAGES = 50000
+    USERS = 200
+    SEEDED_TABLES = {
+        Garden._meta.db_table: GARDENS,
+        Comment._meta.db_table: COMMENTS,
+        Conversation._meta.db_table: CONVERSATIONS,
+        Photo._meta.db_table: PHOTOS,
+        Message._meta.db_table: MESSAGES,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        now = timezone.now()
+        User.objects.bulk_create(
+            User(email=f"plan-{i}@test.com", password="!") for i in range(cls.USERS))
+        user_ids = list(User.objects.values_list("id", flat=True))
+        zipcodes = [f"{rng.randint(1000, 95999):05d}" for i in range(500)]
+        words = ["potager", "tomates", "roses", "verger", "courges", "herbes"]
+
+        Garden.objects.bulk_create(
+            Garden(
+                user_id=rng.choice(user_ids),
+                title=" ".join(rng.sample(words, 2)),
+                description=" ".join(
+                    rng.sample(words, 3) + ["framboisiers"] * (i % 1000 == 0)),
+                zipcode=rng.choice(zipcodes),
+                created_at=now - timezone.timedelta(minutes=i),
+                latitude=48.8 + rng.random() / 5,
+                longitude=2.2 + rng.random() / 5,
+            )
+            for i in range(cls.GARDENS)
+        )
+        garden_ids = list(Garden.objects.values_list("id", flat=True))
+        Photo.objects.bulk_create(
+            Photo(garden_id=garden_ids[i % len(garden_ids)], is_main_photo=False)
+            for i in range(cls.PHOTOS)
+        )
+        Comment.objects.bulk_create(
+            Comment(
+                author_id=rng.choice(user_ids),
+                receiver_id=rng.choice(user_ids),
+                content="merci",
+                created_at=now - timezone.timedelta(minutes=i),
+            )
+            for i in range(cls.COMMENTS)
+        )
+        pairs = list(itertools.combinations_with_replacement(user_ids, 2))
+        Conversation.objects.bulk_create(
+            Conversation(
+                chat_sender_id=low, chat_receiver_id=high,
+                low_user_id=low, high_user_id=high,
+            )
+            for low, high in rng.sample(pairs, cls.CONVERSATIONS)
+        )
+        conversation_ids = list(Conversation.objects.values_list("id", flat=True))
+        Message.objects.bulk_create(
+            Message(
+                conversation_id=rng.choice(conversation_ids),
+                sender_id=rng.choice(user_ids),
+                content="bonjour",
+                sent_at=now - timezone.timedelta(seconds=i),
+            )
+            for i in range(cls.MESSAGES)
+        )
+        with connection.cursor() as cursor:
+            # Fold freshly inserted rows into the GIN index as autovacuum would.
+            cursor.execute(
+                "SELECT gin_clean_pending_list('apis_garden_search_vector_gin')")
+            for table in cls.SEEDED_TABLES:
+                cursor.execute(f"ANALYZE {table}")
+
+        cls.user = User.objects.get(pk=user_ids[0])
+        cls.zipcode = zipcodes[0]
+        cls.garden = Garden.objects.get(pk=garden_ids[0])
+        cls.conversation = Conversation.objects.filter(
+            chat_sender_id=cls.user.id).first()
+
+    def plan_nodes(self, plan):
+        yield plan
+        for child in plan.get("Plans", []):
+            yield from self.plan_nodes(child)
+
+    def assert_indexed(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        assert response.status_code == 200, url
+
+        for query in context.captured_queries:
+            sql = query["sql"]
+            if not sql.startswith("SELECT"):
+                continue
+            # Offset pages of a whole table count it exactly, which is what
+            # cursor pages are for.
+            if sql.startswith("SELECT COUNT(*)") and " WHERE " not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = cursor.fetchone()[0][0]["Plan"]
+            for node in self.plan_nodes(plan):
+                table = node.get("Relation Name")
+                assert not (
+                    node["Node Type"] == "Seq Scan" and table in self.SEEDED_TABLES
+                ), f"Sequential scan on {table} for {url}:\n{sql}"
+                if node["Node Type"] == "Sort":
+                    sorted_rows = node["Plans"][0]["Plan Rows"]
+                    assert sorted_rows < min(self.SEEDED_TABLES.values()) / 2, (
+                        f"Sort over {sorted_rows} rows for {url}:\n{sql}")
+
+    def test_garden_endpoints_use_indexes(self):
+        self.assert_indexed("/api/gardens")
+        self.assert_indexed("/api/gardens?cursor=")
+        self.assert_indexed(f"/api/gardens?zipcode={self.zipcode}")
+        self.assert_indexed(f"/api/gardens?user_id={self.user.id}")
+        self.assert_indexed(f"/api/gardens/{self.garden.id}")
+        self.assert_indexed("/api/gardens?q=framboisiers")
+
+    def test_photo_endpoints_use_indexes(self):
+        self.assert_indexed(f"/api/photos?garden_id={self.garden.id}")
+        self.assert_indexed("/api/photos")
+        self.assert_indexed("/api/photos?cursor=")
+
+    def test_comment_endpoints_use_indexes(self):
+        self.assert_indexed(f"/api/comments?receiver_id={self.user.id}")
+        self.assert_indexed("/api/comments")
+        self.assert_indexed("/api/comments?cursor=")
+
+    def test_conversation_endpoints_use_indexes(self):
+        self.client.force_authenticate(user=self.user)
+        self.assert_indexed(
+            f"/api/conversations?current_user_id={self.user.id}")
+        self.assert_indexed(
+            f"/api/conversations?current_user_id={self.user.id}&cursor=")
+        self.assert_indexed(
+            f"/api/conversations/{self.conversation.id}"
+            f"?current_user_id={self.user.id}")
+        self.assert_indexed(
+            f"/api/conversations/{self.conversation.id}/messages")
+        message = Message.objects.filter(conversation=self.conversation).first()
+        self.assert_indexed(
+            f"/api/conversations/{self.conversation.id}/messages"
+            f"?after_id={message.id}")
@@ -0,0 +1,61 @@
+"""Storage of the part files of resumable uploads, see UploadSession."""
+import os
+import re
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+
+CHUNK_READ_SIZE = 64 * 1024
+
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def parse_content_range(header):
+    """Return (start, end, total) from a Content-Range header, or None."""
+    match = CONTENT_RANGE.match(header or "")
+    if match is None:
+        return None
+    start, end, total = (int(value) for value in match.groups())
+    if start > end or end >= total:
+        return None
+    return start, end, total
+
+
+def write_chunk(session, stream, start, length):
+    """Write length bytes of stream at start in the part file of session.
+
+    Bytes after start that weren't acknowledged are discarded first. Returns
+    the number of bytes received, which is less than length if the client
+    disconnected: the caller must then leave the session's offset alone.
+    """
+    path = default_storage.path(session.part_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    received = 0
+    with open(path, "r+b" if os.path.exists(path) else "wb") as part:
+        part.seek(start)
+        part.truncate()
+        while received < length and stream is not None:
+            chunk = stream.read(min(CHUNK_READ_SIZE, length - received))
+            if not chunk:
+                break
+            part.write(chunk)
+            received += len(chunk)
+    return received
+
+
+class PartFile(UploadedFile):
+    """A completed part file, moved rather than copied when it is saved."""
+
+    def __init__(self, session):
+        path = default_storage.path(session.part_name)
+        super().__init__(open(path, "rb"), session.filename, None, session.size)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def delete_part(session):
+    path = default_storage.path(session.part_name)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,238 @@
+"""Resized copies of uploaded images, so clients don't download originals.
+
+Variants are written next to their source, under a ``variants/`` directory,
+and recorded on the model as ``{"source": name, "sizes": {width: name}}``.
+Widths the original is too small for are skipped; clients fall back to the
+original image. They are generated, along with the modern encodings of the
+image and its variants, by an ``image_variants`` job queued when the image
+changes.
+"""
+import io
+import logging
+import posixpath
+import re
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from accounts.models import ProcessingStatus, User
+
+from . import cache, encodings, jobs
+from .models import Garden, Job, Photo, StoredFile
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640, 1280)
+JPEG_QUALITY = 85
+ORIENTATION_TAG = 0x0112
+
+VARIANT_FILENAME = re.compile(r"^(.+)_\d+w\.\w+$")
+
+# Image field, variants field and status field of each model with variants.
+IMAGE_FIELDS = {
+    "apis.Photo": ("image", "variants", "processing_status"),
+    "accounts.User": ("profile_image", "profile_image_variants",
+                      "profile_image_status"),
+}
+
+
+def variant_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    root = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{root}_{width}w.{extension}")
+
+
+def source_prefix(name):
+    """The name of the source of a variant up to its extension, or None if
+    name isn't the name of a variant."""
+    directory, filename = posixpath.split(name)
+    parent, leaf = posixpath.split(directory)
+    match = VARIANT_FILENAME.match(filename)
+    if leaf != "variants" or match is None:
+        return None
+    return posixpath.join(parent, match.group(1)) + "."
+
+
+def derived_files(stored_file):
+    """The StoredFile rows of the variants and encodings of a source file.
+
+    Encodings are shared by every file with the same content, so those of
+    a content still stored under another name are left out.
+    """
+    directory, filename = posixpath.split(stored_file.name)
+    root = posixpath.splitext(filename)[0]
+    prefix = posixpath.join(directory, "variants", f"{root}_")
+    variant_files = [
+        variant for variant in StoredFile.objects.filter(name__startswith=prefix)
+        if source_prefix(variant.name) == posixpath.join(directory, root) + "."
+    ]
+    sources = [stored_file, *variant_files]
+    checksums = {source.checksum for source in sources if source.checksum}
+    shared = set(
+        StoredFile.objects.filter(checksum__in=checksums)
+        .exclude(pk__in=[source.pk for source in sources])
+        .exclude(name__startswith=encodings.ENCODINGS_DIRECTORY + "/")
+        .values_list("checksum", flat=True)
+    )
+    encoding_names = [
+        encodings.encoding_name(checksum, image_format)
+        for checksum in checksums - shared for image_format in encodings.FORMATS
+    ]
+    return variant_files + list(StoredFile.objects.filter(name__in=encoding_names))
+
+
+def has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def render(image, width, image_format):
+    height = max(1, round(image.height * width / image.width))
+    resized = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+    output = io.BytesIO()
+    if image_format == "PNG":
+        resized.save(output, "PNG", optimize=True)
+    else:
+        resized.convert("RGB").save(
+            output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return ContentFile(output.getvalue())
+
+
+def generate_variants(file, overwrite=False):
+    """Write the missing variants of an image file and return their names."""
+    storage = file.storage
+    sizes = {}
+    with storage.open(file.name) as source, Image.open(source) as image:
+        # Opening only reads the header: the pixels are decoded once, below,
+        # and only if some variant actually has to be rendered.
+        image_format = "PNG" if has_alpha(image) else "JPEG"
+        extension = "png" if image_format == "PNG" else "jpg"
+        rotated = image.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8)
+        displayed_width = image.height if rotated else image.width
+        widths = [width for width in VARIANT_WIDTHS if width < displayed_width]
+        names = {width: variant_name(file.name, width, extension)
+                 for width in widths}
+        # The index decides what exists: a file left behind by an earlier
+        # run or a crashed job isn't indexed, and is written again.
+        indexed = set(StoredFile.objects.filter(
+            name__in=names.values()).values_list("name", flat=True))
+        missing = [width for width in widths
+                   if overwrite or names[width] not in indexed
+                   or not storage.exists(names[width])]
+        if missing:
+            # JPEG can be decoded straight at a fraction of its size.
+            scale = max(missing) / displayed_width
+            image.draft("RGB", (round(image.width * scale),
+                                round(image.height * scale)))
+            image = ImageOps.exif_transpose(image)
+            for width in sorted(missing, reverse=True):
+                storage.delete(names[width])
+                storage.save(names[width], render(image, width, image_format))
+        for width in widths:
+            sizes[str(width)] = names[width]
+    return sizes
+
+
+def refresh_variants(instance, overwrite=False):
+    """Generate the variants of the image of instance and record them.
+
+    Files that aren't images are marked as failed; other errors, such as a
+    missing file, are raised so that the job is retried.
+    """
+    field_name, variants_field, status_field = IMAGE_FIELDS[instance._meta.label]
+    file = getattr(instance, field_name)
+    status = ProcessingStatus.READY
+    try:
+        sizes = generate_variants(file, overwrite) if file else {}
+        if file:
+            encodings.encode(file.storage, [file.name, *sizes.values()])
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("Could not generate variants of %s", file.name,
+                       exc_info=True)
+        sizes = {}
+        status = ProcessingStatus.FAILED
+    variants = {"source": file.name, "sizes": sizes}
+    setattr(instance, variants_field, variants)
+    setattr(instance, status_field, status)
+    type(instance)._default_manager.filter(pk=instance.pk).update(
+        **{variants_field: variants, status_field: status})
+
+
+def expire_responses(model, pks):
+    """Expire cached and conditional responses embedding these images."""
+    now = timezone.now()
+    if model is Photo:
+        Garden.objects.filter(main_photo__in=pks).update(updated_at=now)
+    else:
+        User.objects.filter(pk__in=pks).update(updated_at=now)
+    cache.invalidate("gardens", "photos", "users", "comments")
+
+
+def queue_variants(instance):
+    """Queue the generation of the variants of instance if its image changed."""
+    field_name, variants_field, status_field = IMAGE_FIELDS[instance._meta.label]
+    name = getattr(instance, field_name).name
+    if getattr(instance, variants_field).get("source") == name:
+        return
+    payload = {"model": instance._meta.label, "pk": instance.pk, "name": name}
+    already_queued = Job.objects.filter(
+        kind="image_variants",
+        status__in=[Job.Status.QUEUED, Job.Status.RUNNING],
+        payload=payload,
+    ).exists()
+    if already_queued:
+        return
+    setattr(instance, status_field, ProcessingStatus.PENDING)
+    type(instance)._default_manager.filter(pk=instance.pk).update(
+        **{status_field: ProcessingStatus.PENDING})
+    jobs.enqueue("image_variants", **payload)
+
+
+def queue_new_variants(instances):
+    """Queue the variants of instances just created with bulk_create.
+
+    Their status must already be pending, since bulk_create doesn't send
+    the post_save signal that would queue them one by one.
+    """
+    jobs.enqueue_many("image_variants", [
+        {"model": instance._meta.label, "pk": instance.pk,
+         "name": getattr(instance, IMAGE_FIELDS[instance._meta.label][0]).name}
+        for instance in instances
+    ])
+
+
+def get_current_instance(model, pk, name):
+    """The instance a job was queued for, unless its image changed since."""
+    field_name = IMAGE_FIELDS[model][0]
+    instance = apps.get_model(model)._default_manager.filter(pk=pk).first()
+    if instance is None or getattr(instance, field_name).name != name:
+        return None
+    return instance
+
+
+def mark_failed(model, pk, name):
+    instance = get_current_instance(model, pk, name)
+    if instance is not None:
+        status_field = IMAGE_FIELDS[model][2]
+        type(instance)._default_manager.filter(pk=pk).update(
+            **{status_field: ProcessingStatus.FAILED})
+        expire_responses(type(instance), [pk])
+
+
+@jobs.handler("image_variants", on_failure=mark_failed)
+def process_image(model, pk, name):
+    instance = get_current_instance(model, pk, name)
+    if instance is not None:
+        refresh_variants(instance)
+        expire_responses(type(instance), [pk])
+
+
+def variant_urls(request, file, variants):
+    """Absolute URLs of the variants of file, keyed by width."""
+    if not request or not variants or variants.get("source") != file.name:
+        return {}
+    return {
+        width: request.build_absolute_uri(file.storage.url(name))
+        for width, name in variants.get("sizes", {}).items()
+    }
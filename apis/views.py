@@ -1,15 +1,40 @@
+import posixpath
+import re
+from collections import Counter
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
 from django.db.models import Q
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
 
 
+from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
+
+from accounts.models import ProcessingStatus
 
-from .models import Comment, Conversation, Garden, Message, Photo, User
+from . import cache, encodings, geo, storage, uploads, variants
+from .cache import CachedReadMixin
+from .conditional import ConditionalGetMixin
+from .models import (Comment, Conversation, Garden, Message, Photo,
+                     StoredFile, UploadSession)
+from .pagination import HistoryPagination
 from .permissions import (IsCommentOwnerPermission,
                           IsConversationMembersPermission,
                           IsConversationParticipant, IsGardenOwnerPermission,
@@ -17,15 +42,20 @@ from .permissions import (IsCommentOwnerPermission,
 from .serializers import (CommentSerializer, ConversationPostSerializer,
                           ConversationShowSerializer, GardenSerializer,
                           ListConversationSerializer, MessageSerializer,
-                          PhotoSerializer)
+                          PhotoBatchSerializer, PhotoSerializer,
+                          UploadSessionSerializer)
 
 
-class GardenViewset(ModelViewSet):
+class GardenViewset(CachedReadMixin, ConditionalGetMixin, ModelViewSet):
 
     serializer_class = GardenSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsGardenOwnerPermission]
+    cursor_ordering = ("-created_at", "-id")
+    cache_namespace = "gardens"
+    conditional_fields = ("updated_at", "user__updated_at")
+    conditional_namespaces = ("gardens",)
 
-    queryset = Garden.objects.all()
+    queryset = Garden.objects.for_listing().order_by("-created_at", "-id")
 
     def get_permissions(self):
         if self.action in ["update", "partial_update"]:
@@ -38,12 +68,35 @@ class GardenViewset(ModelViewSet):
         queryset = self.queryset
         user_id = self.request.query_params.get("user_id")
         zipcode = self.request.query_params.get("zipcode")
+        near = self.request.query_params.get("near")
+        search = self.request.query_params.get("q")
         if user_id is not None:
-            queryset = self.queryset.filter(user_id=user_id)
+            queryset = queryset.filter(user_id=user_id)
         if zipcode is not None:
-            queryset = self.queryset.filter(zipcode=zipcode)
+            queryset = queryset.filter(zipcode=zipcode)
+        if search:
+            # Results are sorted by relevance, which keyset pagination can't follow.
+            self.cursor_ordering = None
+            queryset = queryset.search(search)
+        if near is not None:
+            queryset = self.filter_near(queryset, near)
         return queryset
 
+    def filter_near(self, queryset, zipcode):
+        centroid = geo.locate_zipcode(zipcode)
+        if centroid is None:
+            raise ValidationError({"near": "Unknown zipcode."})
+        try:
+            radius_km = float(self.request.query_params.get("radius_km", 5))
+        except ValueError:
+            raise ValidationError({"radius_km": "A valid number is required."})
+        if not 0 < radius_km <= geo.MAX_RADIUS_KM:
+            raise ValidationError({
+                "radius_km": f"Must be between 0 and {geo.MAX_RADIUS_KM}."})
+        # Results are sorted by distance, which keyset pagination can't follow.
+        self.cursor_ordering = None
+        return queryset.near(*centroid, radius_km)
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["request"] = self.request
@@ -51,15 +104,19 @@ class GardenViewset(ModelViewSet):
         return context
 
 
-class PhotoViewset(ModelViewSet):
+class PhotoViewset(CachedReadMixin, ModelViewSet):
     serializer_class = PhotoSerializer
     permission_classes = [IsAuthenticatedOrReadOnly,
                           IsGardenPhotoOwnerPermission]
     parser_classes = (MultiPartParser, FormParser)
-    queryset = Photo.objects.all()
+    cursor_ordering = ("-id",)
+    cache_namespace = "photos"
+    queryset = Photo.objects.order_by("-id")
+    batch_max_files = 30
 
     def get_permissions(self):
-        if self.action in ["create", "update", "partial_update", "delete"]:
+        if self.action in ["create", "batch", "update", "partial_update",
+                           "destroy"]:
             permission_classes = [IsAuthenticated,
                                   IsGardenPhotoOwnerPermission]
         else:
@@ -80,13 +137,185 @@ class PhotoViewset(ModelViewSet):
             raise PermissionDenied(
                 "You don't have permission to add photos to this garden."
             )
+        save_photo(serializer, garden)
+
+    def perform_update(self, serializer):
+        save_photo(serializer, serializer.instance.garden)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """Upload several photos of a garden, sent as images.
+
+        Each file gets its own result, with either the photo or the errors
+        that kept it from being saved.
+        """
+        serializer = PhotoBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        garden = get_object_or_404(Garden, id=serializer.validated_data["garden_id"])
+        if garden.user_id != request.user.id:
+            raise PermissionDenied(
+                "You don't have permission to add photos to this garden."
+            )
+        files = request.FILES.getlist("images")
+        if not 0 < len(files) <= self.batch_max_files:
+            raise ValidationError(
+                {"images": f"Send between 1 and {self.batch_max_files} files."})
+
+        main_photo_index = serializer.validated_data.get("main_photo_index")
+        results, photos = [], []
+        for index, file in enumerate(files):
+            result = {"filename": file.name}
+            results.append(result)
+            file_serializer = self.get_serializer(data={
+                "image": file,
+                "is_main_photo": index == main_photo_index,
+                "season": serializer.validated_data["season"],
+            })
+            if not file_serializer.is_valid():
+                result["errors"] = file_serializer.errors
+                continue
+            photo = Photo(
+                garden=garden,
+                processing_status=ProcessingStatus.PENDING,
+                **file_serializer.validated_data,
+            )
+            photo.image.save(file.name, file, save=False)
+            photos.append(photo)
+            result["photo"] = photo
+
+        if photos:
+            self.save_batch(garden, photos)
+        for result in results:
+            if "photo" in result:
+                result["photo"] = self.get_serializer(result["photo"]).data
+        return Response(
+            {"results": results},
+            status=status.HTTP_201_CREATED if photos else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def save_batch(self, garden, photos):
+        # bulk_create doesn't send signals: do what their receivers would.
+        with transaction.atomic():
+            garden = Garden.objects.select_for_update().get(pk=garden.pk)
+            if any(photo.is_main_photo for photo in photos):
+                garden.photo_set.filter(is_main_photo=True).update(
+                    is_main_photo=False)
+            Photo.objects.bulk_create(photos)
+            garden.refresh_main_photo()
+            for name, count in Counter(photo.image.name for photo in photos).items():
+                storage.acquire(name, count)
+            variants.queue_new_variants(photos)
+        cache.invalidate("gardens", "photos", "users")
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            garden = Garden.objects.select_for_update().get(pk=instance.garden_id)
+            instance.delete()
+            garden.refresh_main_photo()
+
+
+def save_photo(serializer, garden):
+    # The garden row lock serializes concurrent writes so that the
+    # main photo flag and the garden's pointer never disagree.
+    with transaction.atomic():
+        garden = Garden.objects.select_for_update().get(pk=garden.pk)
+        if serializer.validated_data.get("is_main_photo"):
+            garden.photo_set.filter(is_main_photo=True).update(
+                is_main_photo=False)
         serializer.save(garden=garden)
+        garden.refresh_main_photo()
+
+
+class UploadViewset(CreateModelMixin, RetrieveModelMixin, GenericViewSet):
+    """Resumable photo uploads.
+
+    POST /api/uploads opens a session for a file of a given size, then each
+    PUT /api/uploads/<id> sends the chunk described by its Content-Range
+    header. The next chunk starts at the session's offset, also returned by
+    GET /api/uploads/<id> to resume an interrupted upload. POST
+    /api/uploads/<id>/finalize turns the complete file into a Photo.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        garden = get_object_or_404(
+            Garden, id=serializer.validated_data["garden_id"])
+        if garden.user_id != self.request.user.id:
+            raise PermissionDenied(
+                "You don't have permission to add photos to this garden."
+            )
+        serializer.save(user=self.request.user)
+
+    def update(self, request, pk=None):
+        content_range = uploads.parse_content_range(
+            request.headers.get("Content-Range"))
+        if content_range is None:
+            raise ValidationError(
+                {"Content-Range": "Expected bytes <start>-<end>/<size>."})
+        start, end, total = content_range
+        length = end - start + 1
+        if request.headers.get("Content-Length") != str(length):
+            raise ValidationError(
+                {"Content-Length": "Must match the Content-Range header."})
+
+        with transaction.atomic():
+            session = get_object_or_404(
+                self.get_queryset().select_for_update(), pk=pk)
+            if total != session.size:
+                raise ValidationError(
+                    {"Content-Range": f"The upload is {session.size} bytes long."})
+            if session.photo_id is not None or start != session.offset:
+                return Response(self.get_serializer(session).data,
+                                status=status.HTTP_409_CONFLICT)
+            received = uploads.write_chunk(session, request.stream, start, length)
+            if received == length:
+                session.offset = end + 1
+                session.save(update_fields=["offset", "updated_at"])
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        with transaction.atomic():
+            session = get_object_or_404(
+                self.get_queryset().select_for_update(), pk=pk)
+            if session.photo_id is not None:
+                # The client didn't get the response of a previous call.
+                return Response(PhotoSerializer(
+                    session.photo, context=self.get_serializer_context()).data)
+            if session.offset != session.size:
+                return Response(self.get_serializer(session).data,
+                                status=status.HTTP_409_CONFLICT)
+
+            part = uploads.PartFile(session)
+            try:
+                serializer = PhotoSerializer(
+                    data={"garden_id": session.garden_id, "image": part,
+                          "is_main_photo": session.is_main_photo,
+                          "season": session.season},
+                    context=self.get_serializer_context())
+                serializer.is_valid(raise_exception=True)
+                save_photo(serializer, session.garden)
+            finally:
+                part.close()
+            session.photo = serializer.instance
+            session.save(update_fields=["photo", "updated_at"])
+        uploads.delete_part(session)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class CommentViewset(ModelViewSet):
+class CommentViewset(ConditionalGetMixin, ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsCommentOwnerPermission]
-    queryset = Comment.objects.all().order_by("-created_at")
+    cursor_ordering = ("-created_at", "-id")
+    conditional_fields = ("updated_at", "author__updated_at")
+    conditional_namespaces = ("comments",)
+    queryset = Comment.objects.select_related(
+        "author").order_by("-created_at")
 
     def get_queryset(self):
         queryset = self.queryset
@@ -101,38 +330,112 @@ class CommentViewset(ModelViewSet):
 
 class ConversationViewset(ModelViewSet):
     permission_classes = [IsAuthenticated, IsConversationMembersPermission]
+    cursor_ordering = ("-updated_at", "-id")
     queryset = Conversation.objects.all()
 
     def get_queryset(self):
-        queryset = self.queryset
-        current_user_id = self.request.query_params.get(
-            'current_user_id', None)
-        if current_user_id:
-            try:
-                queryset = self.queryset.filter(
-                    Q(chat_receiver_id=current_user_id) | Q(
-                        chat_sender_id=current_user_id)
-                ).order_by("-updated_at")
-            except User.DoesNotExist:
-                raise ValidationError(
-                    "User with the specified ID does not exist.")
-        else:
-            queryset = queryset.none()
-        return queryset
+        # The inbox of the authenticated user; a current_user_id query
+        # parameter is accepted for older clients but ignored.
+        return self.queryset.for_participant(self.request.user).order_by(
+            "-updated_at", "-id")
 
     def perform_create(self, serializer):
         chat_sender_id = self.request.user.id
         chat_receiver_id = self.request.data.get("chat_receiver_id")
         chat_receiver = get_user_model().objects.get(id=chat_receiver_id)
-        conversation_exists = Conversation.objects.filter(Q(chat_sender_id=chat_sender_id, chat_receiver_id=chat_receiver.id) | Q(
-            chat_sender_id=chat_receiver.id, chat_receiver_id=chat_sender_id)).first()
-
-        if conversation_exists:
+        try:
+            with transaction.atomic():
+                serializer.save(chat_sender_id=chat_sender_id,
+                                chat_receiver_id=chat_receiver.id)
+        except IntegrityError:
+            conversation_exists = Conversation.objects.between(
+                chat_sender_id, chat_receiver.id).first()
             raise ValidationError({
                 "error": "Conversation already exists between these two users", "conversation_id": conversation_exists.id})
 
-        serializer.save(chat_sender_id=chat_sender_id,
-                        chat_receiver_id=chat_receiver.id)
+    @action(detail=False, methods=["post"])
+    def open(self, request):
+        """Return the conversation with ``user_id``, starting it if needed."""
+        try:
+            other_user_id = int(request.data.get("user_id"))
+        except (TypeError, ValueError):
+            raise ValidationError({"user_id": "A valid integer is required."})
+        conversation = Conversation.objects.between(
+            request.user.id, other_user_id).first()
+        created = False
+        if conversation is None:
+            if not get_user_model().objects.filter(pk=other_user_id).exists():
+                raise ValidationError({"user_id": "User not found."})
+            conversation, created = Conversation.objects.open(
+                request.user.id, other_user_id)
+        return Response(
+            ConversationPostSerializer(conversation).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        pagination_class=HistoryPagination,
+        cursor_ordering=("-sent_at", "-id"),
+    )
+    def messages(self, request, pk=None):
+        """The conversation's messages, newest first, in keyset pages.
+
+        ``?since=<timestamp>`` or ``?after_id=<message id>`` only returns
+        newer messages, so a client refreshing an open conversation reads
+        a small range of the (conversation, sent_at, id) index.
+        """
+        queryset = Message.objects.filter(conversation_id=pk)
+        since = request.query_params.get("since")
+        after_id = request.query_params.get("after_id")
+        if since is not None:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError({"since": "A valid datetime is required."})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(sent_at__gt=since)
+        if after_id is not None:
+            try:
+                after_id = int(after_id)
+                after = Message.objects.filter(
+                    pk=after_id, conversation_id=pk
+                ).values_list("sent_at", flat=True).first()
+            except (ValueError, OverflowError):
+                raise ValidationError({"after_id": "A valid integer is required."})
+            if after is None:
+                raise ValidationError(
+                    {"after_id": "No such message in this conversation."})
+            queryset = queryset.filter(
+                Q(sent_at__gt=after) | Q(sent_at=after, id__gt=after_id),
+                sent_at__gte=after,
+            )
+
+        page = self.paginate_queryset(queryset)
+        serializer = MessageSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=["post"], permission_classes=[IsAuthenticated])
+    def read(self, request, pk=None):
+        """Mark the conversation read up to its latest message."""
+        try:
+            conversation = Conversation.objects.filter(pk=pk)
+        except (ValueError, TypeError):
+            raise Http404
+        if not conversation.mark_read(request.user):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated])
+    def unread(self, request):
+        """The number of messages the user has not read, all conversations
+        together."""
+        return Response(
+            {"unread_count": Conversation.objects.unread_total(request.user)})
 
     def get_serializer_class(self):
         if self.action == "retrieve":
@@ -145,8 +448,13 @@ class ConversationViewset(ModelViewSet):
 class MessageViewset(ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated, IsConversationParticipant]
+    cursor_ordering = ("-sent_at", "-id")
     queryset = Message.objects.all()
 
+    def get_queryset(self):
+        return self.queryset.filter(
+            conversation__in=Conversation.objects.for_participant(self.request.user))
+
     def perform_create(self, serializer):
         conversation_id = self.request.data.get("conversation_id")
         conversation = get_object_or_404(Conversation, id=conversation_id)
@@ -157,5 +465,140 @@ class MessageViewset(ModelViewSet):
             raise PermissionDenied(
                 "You don't have permission to send message to this person."
             )
+        # Passing the conversation spares the push a query for its members.
         serializer.save(sender_id=self.request.user.id,
-                        conversation_id=conversation.id)
+                        conversation=conversation)
+
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+MEDIA_BLOCK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """Return the (start, end) of a single byte range, or None for the
+    whole file. Raises ValueError if the range can't be satisfied."""
+    match = RANGE.match(header or "")
+    if match is None:
+        # Absent, malformed and multipart ranges get the whole file.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError
+    return start, end
+
+
+def read_range(file, start, length):
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(MEDIA_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve an uploaded file.
+
+    Only published files are served, see published_file(), which keeps the
+    rest of the storage directory private. JPEG and PNG images are replaced
+    by the best encoding the client accepts, see apis.encodings. Once the
+    file is found, the transfer is handed off to the proxy with
+    X-Accel-Redirect or X-Sendfile when MEDIA_ACCEL is set, and streamed
+    from Django otherwise.
+    """
+    stored_file = published_file(path)
+    if stored_file is None:
+        raise Http404("No such file.")
+
+    negotiable = encodings.content_type(path) in encodings.SOURCE_CONTENT_TYPES
+    served_file = (negotiable and encodings.negotiate(request, stored_file)
+                   or stored_file)
+    etag = quote_etag(served_file.checksum or f"{served_file.size}-{served_file.pk}")
+    # updated_at moves with the reference count, not with the content.
+    try:
+        last_modified = default_storage.get_modified_time(served_file.name).timestamp()
+    except FileNotFoundError:
+        raise Http404("No such file.")
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        response = media_response(request, served_file, etag)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if negotiable:
+        patch_vary_headers(response, ["Accept"])
+    if storage.is_content_addressed(stored_file.name):
+        # The name changes with the content, so it can be cached forever.
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response["Cache-Control"] = "public, max-age=3600"
+    return response
+
+
+def published_file(name):
+    """The StoredFile served at name, or None.
+
+    Files of the upload directories are published while a photo or a user
+    references them, and their variants while their source is; their
+    encodings are only served in their place. Unreferenced files and
+    anything else, such as the parts of resumable uploads, stay private.
+    """
+    directory = posixpath.dirname(name)
+    if directory in storage.upload_directories():
+        return StoredFile.objects.filter(name=name, ref_count__gt=0).first()
+    prefix = variants.source_prefix(name)
+    if prefix is None or posixpath.dirname(prefix) not in storage.upload_directories():
+        return None
+    if not StoredFile.objects.filter(
+            name__startswith=prefix, ref_count__gt=0).exists():
+        return None
+    return StoredFile.objects.filter(name=name).first()
+
+
+def media_response(request, stored_file, etag):
+    content_type = encodings.content_type(stored_file.name)
+    if settings.MEDIA_ACCEL == "nginx":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + stored_file.name
+        return response
+    if settings.MEDIA_ACCEL == "apache":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = default_storage.path(stored_file.name)
+        return response
+
+    size = stored_file.size
+    byte_range = None
+    # A range only applies to the version of the file the client has.
+    if request.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    try:
+        file = open(default_storage.path(stored_file.name), "rb")
+    except FileNotFoundError:
+        raise Http404("No such file.")
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(file, start, end - start + 1),
+            status=206, content_type=content_type)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -2,6 +2,8 @@
 ASGI config for Jardipotes project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides the Django project, it serves the server-sent event stream of new
+messages at ``/api/events`` (see apis.realtime).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -9,8 +11,27 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+if settings.DEBUG:
+    # Serve the admin and API docs assets, as runserver does.
+    django_application = ASGIStaticFilesHandler(django_application)
+
+from apis import realtime  # noqa: E402 (needs the apps to be loaded)
+
+EVENTS_PATH = "/api/events"
+
+
+async def application(scope, receive, send):
+    if (
+        scope["type"] == "http"
+        and scope["path"] == EVENTS_PATH
+        and scope["method"] == "GET"
+    ):
+        return await realtime.stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -37,7 +37,12 @@ CORS_ORIGIN_WHITELIST = ["http://localhost:5173", "http://127.0.0.1:5173"]
 
 # MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'accounts/images')
 
-# MEDIA_URL = '/images/'
+# Uploaded files are served by apis.views.serve_media. Behind nginx, set
+# MEDIA_ACCEL=nginx and map MEDIA_ACCEL_PREFIX to the media directory in an
+# internal location; behind Apache with mod_xsendfile, set MEDIA_ACCEL=apache.
+MEDIA_URL = "/media/"
+MEDIA_ACCEL = os.environ.get("MEDIA_ACCEL", "")
+MEDIA_ACCEL_PREFIX = "/protected-media/"
 
 # Application definition
 
@@ -68,7 +73,7 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_PARSER_CLASSES": ("rest_framework.parsers.JSONParser",),
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    "DEFAULT_PAGINATION_CLASS": "apis.pagination.KeysetPagination",
     "PAGE_SIZE": 10,
 }
 
@@ -119,6 +124,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The response cache must be shared by the web process, the job worker and
+# management commands, which all invalidate it. It is kept in the database
+# (see `createcachetable` in entrypoint.sh) unless CACHE_URL points to a
+# faster shared cache, e.g. redis://host:6379/0.
+
+CACHES = {
+    "default": environ.Env().cache_url(
+        "CACHE_URL", default="dbcache://response_cache"),
+}
+
+
+# Real-time events
+# The in-process backend only reaches clients connected to the process that
+# wrote the message. Set REALTIME_BACKEND=apis.realtime.PostgresBackend
+# when running several ASGI workers.
+
+REALTIME_BACKEND = os.environ.get(
+    "REALTIME_BACKEND", "apis.realtime.LocalBackend")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -155,6 +182,26 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded files are recorded in apis.StoredFile, see apis/storage.py
+DEFAULT_FILE_STORAGE = "apis.storage.ContentAddressedStorage"
+
+# Limits of uploaded images, checked before they are decoded, see
+# apis/fields.py. Images over IMAGE_DECODE_MAX_PIXELS are checked at a
+# reduced scale, or without decoding their pixels.
+IMAGE_UPLOAD_MAX_SIZE = 25 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 60_000_000
+IMAGE_DECODE_MAX_PIXELS = 16_000_000
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        # Memory used to check each uploaded image, to tune the limits above.
+        "apis.fields": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
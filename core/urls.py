@@ -1,5 +1,6 @@
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path, re_path
 from drf_yasg import openapi
@@ -8,7 +9,8 @@ from rest_framework import permissions, routers
 
 from accounts.views import AuthViewSet, UserViewSet
 from apis.views import (CommentViewset, ConversationViewset, GardenViewset,
-                        MessageViewset, PhotoViewset)
+                        MessageViewset, PhotoViewset, UploadViewset,
+                        serve_media)
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -27,6 +29,7 @@ router.register(r"api/conversations", ConversationViewset, basename="conversatio
 router.register(r"api/comments", CommentViewset, basename="comments")
 router.register(r"api/gardens", GardenViewset, basename="gardens")
 router.register(r"api/photos", PhotoViewset, basename="photos")
+router.register(r"api/uploads", UploadViewset, basename="uploads")
 router.register(r"api/auth", AuthViewSet, basename="auth")
 router.register(r"api/users", UserViewSet, basename="users")
 
@@ -49,4 +52,9 @@ urlpatterns = [
         schema_view.with_ui("swagger", cache_timeout=0),
         name="schema-swagger-ui",
     ),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(
+        r"^%s(?P<path>.+)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+        serve_media,
+        name="media",
+    ),
+]
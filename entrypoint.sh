@@ -4,5 +4,6 @@ set -e
 
 python manage.py makemigrations
 python manage.py migrate
+python manage.py createcachetable
 
 exec "$@"
\ No newline at end of file